@@ -0,0 +1,207 @@
+#!/usr/bin/python3
+'''
+	Compares the threaded agent runtime with the asyncio one.
+	Rebuilds the core of each agent without a database or slack:
+	the lane queue, dispatcher, timers with pending schedule entries and the http routes server.
+
+	-	idle		cpu time used over a few seconds with nothing to do
+	-	wakeup		latency from put() on another thread to the handler running
+	-	users		events per second for many users, with an io bound handler
+					that waits `io_ms` like a slack call. The asyncio runtime runs it
+					both as an unchanged io_bound Action and as a coroutine handler
+
+	usage: python3 bench/aio.py [idle_secs] [users] [io_ms]
+'''
+import sys
+import os
+import time
+import asyncio
+import threading
+from queue import Empty
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LOGGING_LOGLVL', 'info')
+from gygax.bot.lanes import LaneQueue
+from gygax.bot.dispatch import Dispatcher, LoopDispatcher
+from gygax.bot.events import SendMessageEvent
+from gygax.bot.const import EVENT_TYPES as ETYPES
+from gygax.util.scheduler import Scheduler, LoopScheduler
+from gygax.util.http import Routes
+
+TIMERS = 1000
+PORT = 18080
+
+class Threaded:
+	'''
+		Agent.run: a thread polling the queue with a one second timeout,
+		plus the scheduler thread and the http server thread
+	'''
+	def __init__(self, threads):
+		self.queue = LaneQueue([dict(name = 'message', types = ['MSG'])])
+		self.dispatch = Dispatcher(threads)
+		self.timers = Scheduler()
+		self.routes = Routes('127.0.0.1', PORT)
+		self.running = threading.Event()
+		self.thread = threading.Thread(target = self.run, daemon = True)
+
+	def put(self, event):
+		self.queue.put(event)
+
+	def start(self):
+		for x in range(TIMERS):
+			self.timers.schedule('timer_%s'%x, 3600 + x, print)
+		self.running.set()
+		self.timers.start()
+		self.routes.start()
+		self.thread.start()
+
+	def run(self):
+		while self.running.is_set():
+			try:
+				events = self.queue.get_batch(64, True, 1)
+			except Empty:
+				continue
+			self.dispatch.batch(events)
+
+	def stop(self):
+		self.running.clear()
+		self.timers.join()
+		self.routes.join()
+		self.thread.join()
+		self.dispatch.shutdown()
+
+class Async:
+	'''
+		AsyncAgent.run: one loop thread serving timers and routes,
+		woken by put() only when there are events
+	'''
+	def __init__(self, threads):
+		self.loop = asyncio.new_event_loop()
+		self.queue = LaneQueue([dict(name = 'message', types = ['MSG'])])
+		self.dispatch = LoopDispatcher(self.loop, threads)
+		self.timers = LoopScheduler(self.loop)
+		self.routes = Routes('127.0.0.1', PORT + 1)
+		self.running = threading.Event()
+		self.signalled = False
+		self.thread = threading.Thread(target = self.run, daemon = True)
+
+	def put(self, event):
+		self.queue.put(event)
+		if not self.signalled:
+			self.signalled = True
+			self.loop.call_soon_threadsafe(self.signal)
+
+	def signal(self):
+		self.signalled = False
+		self.wakeup.set()
+
+	def start(self):
+		for x in range(TIMERS):
+			self.timers.schedule('timer_%s'%x, 3600 + x, print)
+		self.running.set()
+		self.thread.start()
+		while not self.loop.is_running():
+			time.sleep(0.01)
+
+	def run(self):
+		asyncio.set_event_loop(self.loop)
+		self.loop.run_until_complete(self.main())
+
+	async def main(self):
+		self.wakeup = asyncio.Event()
+		server = await self.routes.serve()
+		while self.running.is_set():
+			await self.wakeup.wait()
+			self.wakeup.clear()
+			while True:
+				try:
+					events = self.queue.get_batch(64, False)
+				except Empty:
+					break
+				self.dispatch.batch(events)
+				await asyncio.sleep(0)
+		server.close()
+		await server.wait_closed()
+
+	def stop(self):
+		self.running.clear()
+		self.loop.call_soon_threadsafe(self.signal)
+		self.thread.join()
+		self.dispatch.shutdown()
+
+def event(user, stamp):
+	return SendMessageEvent('msg_send', dict(user = user, stamp = stamp))
+
+def idle(runtime, secs):
+	runtime.start()
+	time.sleep(0.5)
+	start = time.process_time()
+	time.sleep(secs)
+	used = time.process_time() - start
+	runtime.stop()
+	return used
+
+def wakeup(runtime, count = 1000):
+	seen = []
+	def handler(event):
+		seen.append(time.perf_counter() - event._get('stamp'))
+	runtime.dispatch.register(ETYPES.MSG, 'msg_send', handler)
+	runtime.start()
+	for x in range(count):
+		runtime.put(event('U1', time.perf_counter()))
+		time.sleep(0.001)
+	while len(seen) < count:
+		time.sleep(0.01)
+	runtime.stop()
+	seen.sort()
+	return seen[len(seen) // 2] * 1e6, seen[int(len(seen) * 0.99)] * 1e6
+
+class SlowAction:
+	'''
+		An io_bound Action, blocking like a requests call
+	'''
+	io_bound = True
+	concurrency = 8
+	def __init__(self, io, done):
+		self.io = io
+		self.done = done
+
+	def __call__(self, event):
+		time.sleep(self.io)
+		self.done()
+
+def users(runtime, count, io, coroutine = False, per_user = 5):
+	lock = threading.Lock()
+	finished = threading.Event()
+	total = count * per_user
+	handled = [0]
+	def done():
+		with lock:
+			handled[0] += 1
+			if handled[0] == total:
+				finished.set()
+	async def slow(event):
+		await asyncio.sleep(io)
+		done()
+	runtime.dispatch.register(ETYPES.MSG, 'msg_send', slow if coroutine else SlowAction(io, done))
+	runtime.start()
+	start = time.perf_counter()
+	for x in range(per_user):
+		for u in range(count):
+			runtime.put(event('U%s'%u, 0))
+	finished.wait()
+	elapsed = time.perf_counter() - start
+	runtime.stop()
+	return total / elapsed
+
+if __name__ == '__main__':
+	secs = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+	count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+	io = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.005
+	for name, cls in (('threaded', Threaded), ('asyncio', Async)):
+		print('%-9s idle cpu over %ss: %.2fms'%(name, secs, idle(cls(0), secs) * 1000))
+	for name, cls in (('threaded', Threaded), ('asyncio', Async)):
+		p50, p99 = wakeup(cls(0))
+		print('%-9s wakeup latency p50=%.0fus p99=%.0fus'%(name, p50, p99))
+	print('%-9s %s users, io bound action on 8 threads: %.0f events/s'%('threaded', count, users(Threaded(8), count, io)))
+	print('%-9s %s users, io bound action on 8 threads: %.0f events/s'%('asyncio', count, users(Async(8), count, io)))
+	print('%-9s %s users, coroutine handler: %.0f events/s'%('asyncio', count, users(Async(8), count, io, True)))
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+'''
+	Measures draining a burst of events from the agent queue
+	one at a time against batched draining and dispatch.
+	`setup_us` adds a fixed cost per handler call, standing in for opening
+	a db session or http connection, which batched handlers pay once per batch.
+	Then runs an io bound batched handler on the executor, sleeping `setup_us` (1ms when 0) per call,
+	with each batch split into a call per user (ordered) and in a single call (ordered = False).
+
+	usage: python3 bench/batch.py [events] [batch] [setup_us]
+'''
+import sys
+import os
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LOGGING_LOGLVL', 'info')
+from gygax.bot.lanes import LaneQueue
+from gygax.bot.dispatch import Dispatcher
+from gygax.bot.events import SendMessageEvent
+from gygax.bot.const import EVENT_TYPES as ETYPES
+
+def spin(secs):
+	end = time.perf_counter() + secs
+	while time.perf_counter() < end:
+		pass
+
+class Handler:
+	batched = True
+	def __init__(self, setup):
+		self.setup = setup
+		self.handled = 0
+
+	def __call__(self, event):
+		spin(self.setup)
+		self.handled += 1
+
+	def batch(self, events):
+		spin(self.setup)
+		self.handled += len(events)
+
+class IOHandler(Handler):
+	io_bound = True
+	concurrency = 4
+	def __call__(self, event):
+		time.sleep(self.setup)
+		self.handled += 1
+
+	def batch(self, events):
+		time.sleep(self.setup)
+		self.handled += len(events)
+
+def run_io(count, batch, setup, ordered, users = 100):
+	disp = Dispatcher(8)
+	handler = IOHandler(setup)
+	handler.ordered = ordered
+	disp.register(ETYPES.MSG, 'msg_send', handler)
+	events = [SendMessageEvent('msg_send', dict(user = 'U%s'%(x % users), text = 'hi')) for x in range(count)]
+	start = time.perf_counter()
+	for x in range(0, count, batch):
+		disp.batch(events[x:x + batch])
+	while handler.handled < count:
+		time.sleep(0.001)
+	elapsed = time.perf_counter() - start
+	disp.shutdown()
+	return elapsed
+
+def run(count, batch, setup):
+	queue = LaneQueue([dict(name = 'message', types = ['MSG'])])
+	disp = Dispatcher()
+	handler = Handler(setup)
+	if batch == 1:
+		handler.batched = False
+	disp.register(ETYPES.MSG, 'msg_send', handler)
+	for x in range(count):
+		queue.put(SendMessageEvent('msg_send', dict(user = 'U%s'%(x % 100), text = 'hi')))
+	start = time.perf_counter()
+	while handler.handled < count:
+		if batch == 1:
+			disp(queue.get(True, 1))
+		else:
+			disp.batch(queue.get_batch(batch, True, 1))
+	return time.perf_counter() - start
+
+if __name__ == '__main__':
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+	batch = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+	setup = float(sys.argv[3]) / 1e6 if len(sys.argv) > 3 else 0
+	for size in (1, batch):
+		elapsed = run(count, size, setup)
+		print('batch=%-4s events=%s elapsed=%.3fs %.1fus/event'%(size, count, elapsed, elapsed / count * 1e6))
+	for ordered in (True, False):
+		elapsed = run_io(count, batch, setup or 0.001, ordered)
+		print('io bound batch=%-4s ordered=%-5s events=%s elapsed=%.3fs %.1fus/event'%(
+				batch, ordered, count, elapsed, elapsed / count * 1e6))
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+'''
+	Runs gygax.util.client against a local stand-in for the slack api.
+		/api/ok		answers {"ok": true}
+		/api/flaky	answers 503 to every other request
+		/api/slow	answers after 2 seconds
+		/api/closed	closes the connection without answering
+	Compares the latency of bare requests.post calls, a new connection each,
+	with the pooled client, then checks retries and timeouts and prints the client's stats.
+
+	usage: python3 bench/client.py [calls]
+'''
+import sys
+import os
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LOGGING_LOGLVL', 'info')
+import requests
+from gygax.util.client import Client
+from gygax.util.metrics import metrics
+
+class StandIn(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'	# Keeps connections open between requests
+	disable_nagle_algorithm = True	# Headers and body are written separately
+	flaky = 0
+
+	def _reply(self, status, body):
+		data = json.dumps(body).encode()
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def do_POST(self):
+		self.rfile.read(int(self.headers.get('Content-Length', 0)))
+		if self.path == '/api/flaky':
+			StandIn.flaky += 1
+			if StandIn.flaky % 2:
+				return self._reply(503, dict(ok = False))
+		elif self.path == '/api/slow':
+			time.sleep(2)
+			self.close_connection = True
+			return
+		elif self.path == '/api/closed':
+			self.close_connection = True
+			return
+		self._reply(200, dict(ok = True))
+
+	def log_message(self, *args):
+		pass
+
+def timed(call, url, count):
+	start = time.perf_counter()
+	for x in range(count):
+		call(url, data = dict(token = 'xoxb', channel = 'D1J5TREAY'))
+	return (time.perf_counter() - start) / count * 1e6
+
+if __name__ == '__main__':
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+	server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+	threading.Thread(target = server.serve_forever, daemon = True).start()
+	base = 'http://127.0.0.1:%s/api'%server.server_address[1]
+	client = Client('slack', connect = 500, read = 500, retries = 2, backoff = 10)
+	print('requests.post  %6.0f us/call'%timed(requests.post, base + '/ok', count))
+	print('client.post    %6.0f us/call'%timed(client.post, base + '/ok', count))
+	for x in range(10):
+		assert client.post(base + '/flaky', idempotent = True).status_code == 200
+	print('flaky, idempotent: 10 calls succeeded')
+	assert client.post(base + '/flaky').status_code == 503
+	print('flaky, not idempotent: 503 returned without a retry')
+	for path in ('/slow', '/closed'):
+		start = time.perf_counter()
+		try:
+			client.post(base + path, idempotent = True)
+		except requests.RequestException as e:
+			print('%-7s raised %s after %.2fs'%(path, type(e).__name__, time.perf_counter() - start))
+	try:
+		client.post('http://127.0.0.1:1/api/ok')
+	except requests.ConnectionError:
+		print('refused connection retried: %s'%metrics.counter('http_retries', 'slack/api/ok').value)
+	print(json.dumps({name: metrics.snapshot()[name] for name in ('http_retries', 'http_errors')}, indent = 1))
+	latency = metrics.snapshot()['http_latency']['slack/api/ok']
+	print('slack/api/ok latency p50 %.0fus p99 %.0fus'%(latency['p50'] * 1e6, latency['p99'] * 1e6))
+	server.shutdown()
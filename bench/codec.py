@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+'''
+	Compares pickle against gygax.bot.codec for the scheduled events in Schedule.data.
+	Measures the per row work of stream_schedule, decoding every stored blob,
+	along with the encoded size.
+
+	usage: python3 bench/codec.py [rows]
+'''
+import sys
+import os
+import time
+import pickle
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LOGGING_LOGLVL', 'info')
+from gygax.bot import codec
+from gygax.bot.events import KillConfirmedEvent, AssignNextRoundEvent, CheckFreeEvent, LockUsersEvent
+
+def rows(count):
+	'''
+		A mix shaped like a live schedule table,
+		mostly auto confirms with some per game and cron events
+	'''
+	for x in range(count):
+		kind = x % 10
+		if kind < 7:
+			yield KillConfirmedEvent('game_confirmed', dict(user = 'U%08d'%x, game = '%0128x'%x))
+		elif kind < 9:
+			yield AssignNextRoundEvent('game_assign_next', dict(game = '%0128x'%x))
+		elif x % 20 == 9:
+			yield LockUsersEvent('cron_lock', dict(users = ['U%08d'%(x + y) for y in range(20)], game = '%0128x'%x))
+		else:
+			yield CheckFreeEvent('cron_check_free')
+
+def bench(label, events, dumps, loads):
+	start = time.perf_counter()
+	blobs = [dumps(e) for e in events]
+	encoded = time.perf_counter() - start
+	start = time.perf_counter()
+	for blob in blobs:
+		loads(blob)
+	decoded = time.perf_counter() - start
+	size = sum(len(b) for b in blobs)
+	print('%-7s rows=%s encode=%.3fs decode=%.3fs (%.2fus/row) bytes=%.1fMB (%.0fB/row)'%(
+		label, len(blobs), encoded, decoded, decoded / len(blobs) * 1e6, size / 2**20, size / len(blobs)))
+
+if __name__ == '__main__':
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	events = list(rows(count))
+	bench('pickle', events, pickle.dumps, pickle.loads)
+	bench('codec', events, codec.encode, codec.decode)
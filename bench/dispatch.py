@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+'''
+	Measures Dispatcher overhead per event as the number of
+	registered topics and handlers per topic grows.
+	Handlers do nothing, so the time is all routing.
+	A quarter of the events have a topic with no handlers.
+
+	usage: python3 bench/dispatch.py [events]
+'''
+import sys
+import os
+import time
+import tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LOGGING_LOGLVL', 'info')
+from gygax.bot.dispatch import Dispatcher
+from gygax.bot.events import MessageEvent
+from gygax.bot.const import EVENT_TYPES as ETYPES
+
+def noop(event):
+	pass
+
+def setup(topics, handlers):
+	disp = Dispatcher()
+	for t in range(topics):
+		for h in range(handlers):
+			disp.register(ETYPES.MSG, 'topic_%s'%t, noop)
+	disp.register(ETYPES.MSG, None, noop)
+	events = [MessageEvent('topic_%s'%(x % topics) if x % 4 else 'unknown_%s'%x, dict(user = 'U1')) for x in range(1000)]
+	return disp, events
+
+def run(count, topics, handlers):
+	disp, events = setup(topics, handlers)
+	rounds = count // len(events)
+	start = time.perf_counter()
+	for r in range(rounds):
+		for event in events:
+			disp(event)
+	elapsed = time.perf_counter() - start
+	tracemalloc.start()
+	for event in events:
+		disp(event)
+	current, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return elapsed / (rounds * len(events)) * 1e9, peak
+
+if __name__ == '__main__':
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+	for topics in (10, 100, 1000):
+		for handlers in (1, 4, 16):
+			ns, peak = run(count, topics, handlers)
+			print('topics=%-5s handlers/topic=%-3s %6.0f ns/event  alloc peak over 1000 events=%sB'%(topics, handlers, ns, peak))
@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+'''
+	Measures the memory held by queued events, and what forwarding an event costs,
+	with tracemalloc.
+
+	-	held		bytes and allocations per live event, for a queue of
+					message, command and game events, not counting their payloads
+	-	forward		bytes and allocations per event for the CommandAction pattern:
+					reading the payload for a log line, then building a new event from it
+	-	time		ns per forwarded event, the same work without tracing
+
+	usage: python3 bench/events.py [events]
+'''
+import sys
+import os
+import time
+import tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LOGGING_LOGLVL', 'info')
+from gygax.bot.events import MessageEvent, CommandEvent, LockUsersEvent, CheckFreeEvent
+
+def payloads(count):
+	return [dict(user = 'U%08d'%x, text = '!set weapon banana', channel = 'D%08d'%x, public = False) for x in range(count)]
+
+def build(data):
+	events = []
+	for x, d in enumerate(data):
+		kind = x % 4
+		if kind == 0:
+			events.append(MessageEvent(None, d))
+		elif kind == 1:
+			events.append(CommandEvent('cmd_set', d, no_parse = True))
+		elif kind == 2:
+			events.append(LockUsersEvent('cron_lock', d))
+		else:
+			events.append(CheckFreeEvent('cron_check'))
+	return events
+
+def forward(events):
+	out = []
+	for event in events:
+		len(event.data())
+		out.append(CommandEvent('cmd_%s'%event.cmd, event.data(), no_parse = True))
+	return out
+
+def traced(fn, *args):
+	tracemalloc.start()
+	before = tracemalloc.take_snapshot()
+	result = fn(*args)
+	after = tracemalloc.take_snapshot()
+	tracemalloc.stop()
+	stats = after.compare_to(before, 'filename')
+	size = sum(s.size_diff for s in stats)
+	blocks = sum(s.count_diff for s in stats)
+	return result, size, blocks
+
+if __name__ == '__main__':
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	data = payloads(count)
+	events, size, blocks = traced(build, data)
+	print('held     %5.1f bytes/event  %4.2f allocations/event'%(size / count, blocks / count))
+	commands = [CommandEvent('cmd_raw', d, no_parse = True) for d in data]
+	for c, d in zip(commands, data):
+		d['cmd'] = 'set'
+	out, size, blocks = traced(forward, commands)
+	print('forward  %5.1f bytes/event  %4.2f allocations/event'%(size / count, blocks / count))
+	del out
+	start = time.perf_counter()
+	forward(commands)
+	print('time     %5.0f ns/event'%((time.perf_counter() - start) / count * 1e9))
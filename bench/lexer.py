@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+'''
+	Compares the regex command parser CommandEvent used before gygax.bot.lexer
+	with the lexer, over a corpus shaped like the firehose cmd topic.
+	Each run parses the text and checks the command is known, as CommandAction does.
+
+	usage: python3 bench/lexer.py [rounds]
+'''
+import sys
+import os
+import re
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LOGGING_LOGLVL', 'info')
+from gygax.bot import lexer
+from gygax.bot.const import CMD_TYPES as CTYPES
+
+CORPUS = [
+	'!set weapon yellow rubber duck',
+	'!set location tables outside cantina',
+	'!set location zone 2',
+	'!set weapon "rubber chicken"',
+	'!help',
+	'!confirm',
+	'!deny',
+	'!target',
+	'!report',
+	'!register',
+	'<@U1J5TREAY> register',
+	'<@U1J5TREAY> help',
+	'<@U1J5TREAY> report the bot keeps crashing',
+	'!unknown thing',
+	'!hi',
+	'hello there',
+]
+
+bang_cmd = r'^!(?P<cmd>[a-z]{3,10})(?:[ \t]+(?P<args>[\w ]+))?'
+at_cmd = r'^<@(?P<user>\w+)>\s(?P<cmd>[a-z]{3,10})(?:[ \t]+(?P<args>[\w ]+))?'
+
+def regex_parse(text):
+	'''
+		CommandEvent._parse and CommandEvent.valid before the lexer
+	'''
+	match = re.match(bang_cmd, text)
+	if not match:
+		match = re.match(at_cmd, text)
+	if not match:
+		return None
+	cmd = match['cmd']
+	args = match['args'].split(' ') if match['args'] is not None else None
+	return cmd.upper() in CTYPES._fields, cmd, args
+
+def lexer_parse(text):
+	kind, cmd, args = lexer.lex(text)
+	if cmd is None:
+		return None
+	return cmd in lexer.COMMANDS, cmd, args
+
+def run(parse, rounds):
+	start = time.perf_counter()
+	for r in range(rounds):
+		for text in CORPUS:
+			parse(text)
+	return (time.perf_counter() - start) / (rounds * len(CORPUS)) * 1e9
+
+if __name__ == '__main__':
+	rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+	for text in CORPUS:
+		print('%-45r %r'%(text, lexer.lex(text)))
+	print('regex  %5.0f ns/command'%run(regex_parse, rounds))
+	print('lexer  %5.0f ns/command'%run(lexer_parse, rounds))
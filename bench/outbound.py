@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+'''
+	Fans a game's worth of messages out through gygax.bot.outbound.Outbound
+	to a local stand-in for chat.postMessage, which answers 429 with a Retry-After
+	once more than `limit` posts arrive within a second, as slack does.
+	Runs the fan-out three ways:
+		dropping	429s count as failed posts, as _send_message did before it raised RateLimited
+		retrying	no token buckets, 429s are retried after their Retry-After
+		buckets		token buckets sized below the stand-in's limit
+	and prints the posts delivered, the 429s seen and the delivery latency,
+	checking every channel received its messages in order.
+
+	usage: python3 bench/outbound.py [players] [messages per player] [limit]
+'''
+import sys
+import os
+import json
+import time
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+class StandIn(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	disable_nagle_algorithm = True
+	limit = 20
+	lock = threading.Lock()
+	sent = []
+	received = defaultdict(list)
+	limited = 0
+
+	def _reply(self, status, body, headers = {}):
+		data = json.dumps(body).encode()
+		self.send_response(status)
+		for key, value in headers.items():
+			self.send_header(key, value)
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def do_POST(self):
+		data = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+		now = time.monotonic()
+		with StandIn.lock:
+			StandIn.sent = [t for t in StandIn.sent if t > now - 1]
+			if len(StandIn.sent) >= StandIn.limit:
+				StandIn.limited += 1
+				return self._reply(429, dict(ok = False, error = 'ratelimited'), {'Retry-After': '1'})
+			StandIn.sent.append(now)
+			StandIn.received[data['channel'][0]].append(data['text'][0])
+		self._reply(200, dict(ok = True))
+
+	def log_message(self, *args):
+		pass
+
+server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+threading.Thread(target = server.serve_forever, daemon = True).start()
+os.environ['API_SLACK_BASE'] = 'http://127.0.0.1:%s/api'%server.server_address[1]
+os.environ.setdefault('LOGGING_LOGLVL', 'critical')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gygax.api.slack import Slack
+from gygax.bot.outbound import Outbound
+from gygax.util.ratelimit import RateLimited
+from gygax.util.metrics import metrics
+
+def post(recipient, text, attachments):
+	return Slack._send_message(recipient[1], text, attachments)
+
+def dropping(recipient, text, attachments):
+	try:
+		return post(recipient, text, attachments)
+	except RateLimited:
+		return False
+
+def run(name, players, count, send = post, **kwargs):
+	StandIn.received.clear()
+	StandIn.limited = 0
+	time.sleep(1)	# Let the stand-in's window empty
+	outbound = Outbound(send, window = 0, threads = 4, **kwargs)
+	delivery = metrics.histogram('outbound_delivery')
+	delivery.__init__()
+	start = time.perf_counter()
+	for x in range(count):
+		for p in range(players):
+			outbound.send(('channel', 'D%s'%p), 'message %s'%x)
+	outbound.join()
+	elapsed = time.perf_counter() - start
+	delivered = sum(len(m) for m in StandIn.received.values())
+	ordered = all(m == sorted(m, key = lambda t: int(t.split()[1])) for m in StandIn.received.values())
+	print('%-9s %3s/%s delivered  %3s 429s  in order: %-5s  %.1fs  latency p50 %.2fs p99 %.2fs'%(
+			name, delivered, players * count, StandIn.limited, ordered, elapsed,
+			delivery.percentile(50), delivery.percentile(99)))
+
+if __name__ == '__main__':
+	players = int(sys.argv[1]) if len(sys.argv) > 1 else 25
+	count = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+	StandIn.limit = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+	rate = StandIn.limit * 0.8	# The stand-in counts a sliding second, so bursts have to stay small
+	run('dropping', players, count, send = dropping)
+	run('retrying', players, count)
+	run('buckets', players, count, rate = rate, burst = 2, channel_rate = 1, channel_burst = 4)
+	server.shutdown()
@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+'''
+	Measures firehose receive throughput through Subscriber._process
+	for v1 framing and v2 framing with a json or msgpack body.
+	The publisher sends in chunks the socket buffers can hold, the subscriber then drains
+	each chunk with _recv and _process as the watcher does. Only the receive side is timed.
+	`size` pads the message text, slack messages are usually short.
+
+	usage: python3 bench/pubsub.py [messages] [size]
+'''
+import sys
+import os
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LOGGING_LOGLVL', 'info')
+from gygax.util.pubsub import Publisher, Subscriber, Transport, msgpack
+
+CHUNK = 500
+
+def run(count, size, port, **kwargs):
+	path = 'tcp://127.0.0.1:%s'%port
+	pub = Publisher(path, **kwargs)
+	pub.open()
+	sub = Subscriber(path)
+	Transport.open(sub)	# Receive on this thread instead of starting the watcher
+	handled = [0]
+	def handler(msg):
+		handled[0] += 1
+	sub.addHandler('msg', handler, strict = False)
+	time.sleep(0.3)
+	event = dict(user = 'U1J5TREAY', channel = 'D1J5TREAY', public = False, text = '!set weapon ' + 'x' * size)
+	elapsed = 0
+	for c in range(count // CHUNK):
+		for x in range(CHUNK):
+			pub.publish('msg', event)
+		time.sleep(0.005)
+		start = time.perf_counter()
+		for x in range(CHUNK):
+			sub._process(sub._recv())
+		elapsed += time.perf_counter() - start
+	pub._socket.close()
+	sub._socket.close()
+	return handled[0] / elapsed
+
+if __name__ == '__main__':
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	size = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+	print('v1               %7.0f msgs/s'%run(count, size, 15601, framing = 1))
+	print('v2 json          %7.0f msgs/s'%run(count, size, 15602, framing = 2))
+	if msgpack:
+		print('v2 msgpack       %7.0f msgs/s'%run(count, size, 15603, framing = 2, codec = 'msgpack'))
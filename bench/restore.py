@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+'''
+	Measures restart to ready time for a persisted schedule.
+	Replays the per row work of Agent._load_schedule, decoding the stored event,
+	applying its misfire policy and arming it on the scheduler, without a database.
+	Part of the rows are past due, as after downtime.
+
+	usage: python3 bench/restore.py [rows] [past_due_percent]
+'''
+import sys
+import os
+import time
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LOGGING_LOGLVL', 'info')
+from gygax.bot import codec
+from gygax.bot.misfire import MisfirePolicy
+from gygax.bot.events import KillConfirmedEvent, AssignNextRoundEvent
+from gygax.util.scheduler import Scheduler
+from gygax.util.time import secs_until
+
+def rows(count, past, now):
+	for x in range(count):
+		offset = timedelta(minutes = x % 720)
+		time = now - offset if x % 100 < past else now + offset
+		if x % 10:
+			event = KillConfirmedEvent('game_confirmed', dict(user = 'U%08d'%x, game = '%0128x'%x))
+			yield codec.encode(event), '12h', 'U%08d_%s_auto_confirm'%(x, x), False, time
+		else:
+			event = AssignNextRoundEvent('game_assign_next', dict(game = '%0128x'%x))
+			yield codec.encode(event), '23:42', '%0128x_assign_next'%x, True, time
+
+if __name__ == '__main__':
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+	past = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+	now = datetime.utcnow()
+	stored = list(rows(count, past, now))
+	policy = MisfirePolicy([dict(match = '*_assign_next', policy = 'once')])
+	timers = Scheduler()
+	fired = []
+	saved = {}
+	start = time.perf_counter()
+	for data, delay, key, repeat, due in stored:
+		event = codec.decode(data)
+		fires, nxt = policy.plan(key, due, delay, repeat, now)
+		for x in range(fires):
+			fired.append(event)
+		if nxt is None:
+			saved[key] = None
+			continue
+		if nxt != due:
+			saved[key] = (event, delay, key, repeat, nxt)
+		timers.schedule(key, secs_until(nxt), fired.append, event)
+	elapsed = time.perf_counter() - start
+	print('rows=%s past_due=%s%% ready in %.3fs (%.1fus/row) armed=%s fired=%s rewritten=%s'%(
+		count, past, elapsed, elapsed / count * 1e6, len(timers), len(fired), len(saved)))
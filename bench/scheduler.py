@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+'''
+	Compares the cost of pending timers between one threading.Timer
+	per entry and the heap based gygax.util.scheduler.Scheduler
+
+	usage: python3 bench/scheduler.py [pending] [timer_pending]
+'''
+import sys
+import os
+import time
+import threading
+import tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gygax.util.scheduler import Scheduler
+
+def rss():
+	try:
+		with open('/proc/self/status') as status:
+			for line in status:
+				if line.startswith('VmRSS'):
+					return int(line.split()[1]) * 1024
+	except OSError:
+		pass
+	return 0
+
+def noop(*args):
+	pass
+
+def bench_scheduler(count):
+	sched = Scheduler()
+	sched.start()
+	base_threads = threading.active_count()
+	base_rss = rss()
+	tracemalloc.start()
+	start = time.perf_counter()
+	for x in range(count):
+		sched.schedule('key_%s'%x, 3600 + x, noop, x)
+	elapsed = time.perf_counter() - start
+	current, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	start = time.perf_counter()
+	for x in range(0, count, 2):
+		sched.cancel('key_%s'%x)
+	cancelled = time.perf_counter() - start
+	result = dict(
+		pending = count,
+		threads = threading.active_count() - base_threads + 1,
+		traced = current,
+		rss = rss() - base_rss,
+		schedule_us = elapsed / count * 1e6,
+		cancel_us = cancelled / (count // 2) * 1e6)
+	sched.join(1)
+	return result
+
+def bench_timers(count):
+	base_threads = threading.active_count()
+	base_rss = rss()
+	timers = []
+	start = time.perf_counter()
+	for x in range(count):
+		t = threading.Timer(3600 + x, noop, (x,))
+		t.daemon = True
+		t.start()
+		timers.append(t)
+	elapsed = time.perf_counter() - start
+	result = dict(
+		pending = count,
+		threads = threading.active_count() - base_threads,
+		traced = None,
+		rss = rss() - base_rss,
+		schedule_us = elapsed / count * 1e6,
+		cancel_us = None)
+	for t in timers:
+		t.cancel()
+	return result
+
+def report(label, result):
+	print('%-10s pending=%-7s threads=%-6s rss=%6.1fMB (%5.0fB/timer) traced=%s schedule=%.2fus cancel=%s'%(
+		label, result['pending'], result['threads'], result['rss'] / 2**20,
+		result['rss'] / result['pending'],
+		'%.1fMB'%(result['traced'] / 2**20) if result['traced'] is not None else '-',
+		result['schedule_us'],
+		'%.2fus'%result['cancel_us'] if result['cancel_us'] is not None else '-'))
+
+if __name__ == '__main__':
+	pending = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	timer_pending = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+	report('scheduler', bench_scheduler(pending))
+	report('timer', bench_timers(timer_pending))
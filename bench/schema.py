@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+'''
+	Compares the strict argument check Subscriber._handle used to rebuild for every message
+	with the compiled firehose message schema, for a valid message and a malformed one.
+
+	usage: python3 bench/schema.py [rounds]
+'''
+import sys
+import os
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LOGGING_LOGLVL', 'info')
+from gygax.util.schema import Schema, Field, SchemaError
+
+MAPPING = dict(user = True, channel = True, text = True, public = True)
+MESSAGE = Schema(
+	user = Field(str, max_len = 32),
+	channel = Field(str, max_len = 32),
+	text = Field(str, max_len = 40000),
+	public = Field(bool),
+)
+
+VALID = dict(user = 'U1J5TREAY', channel = 'D1J5TREAY', text = '!set weapon yellow rubber duck', public = False)
+MALFORMED = dict(user = 'U1J5TREAY', channel = 'D1J5TREAY', text = '!help')
+
+def legacy(message):
+	'''
+		Subscriber._handle's strict check before schemas, with items() for iteritems()
+	'''
+	required = [x for x, y in MAPPING.items() if y]
+	optional = [x for x, y in MAPPING.items() if not y]
+	for arg in message.keys():
+		if arg in required:
+			required.remove(arg)
+		elif not arg in optional:
+			raise SchemaError('extra arguement %s provided'%arg)
+	if required:
+		raise SchemaError('Not all required arguements provided %s'%required)
+
+def run(check, message, rounds):
+	start = time.perf_counter()
+	for r in range(rounds):
+		try:
+			check(message)
+		except SchemaError:
+			pass
+	return (time.perf_counter() - start) / rounds * 1e9
+
+if __name__ == '__main__':
+	rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+	compiled = MESSAGE.compile()
+	for name, message in (('valid', VALID), ('malformed', MALFORMED)):
+		print('%-10s legacy    %5.0f ns/message'%(name, run(legacy, message, rounds)))
+		print('%-10s compiled  %5.0f ns/message'%(name, run(compiled, message, rounds)))
@@ -0,0 +1,45 @@
+#!/usr/bin/python3
+'''
+	Measures event throughput of the keyed worker pool against a single worker.
+	Each handler call sleeps to stand in for a slack or database round trip.
+
+	usage: python3 bench/workers.py [events] [users] [workers] [io_ms]
+'''
+import sys
+import os
+import time
+import threading
+from collections import defaultdict
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gygax.bot.workers import WorkerPool
+from gygax.bot.events import SendMessageEvent
+
+def run(events, size, io):
+	seen = defaultdict(list)
+	done = threading.Semaphore(0)
+	def handler(event):
+		time.sleep(io)
+		seen[event.user].append(event._get('seq'))
+		done.release()
+	pool = WorkerPool(handler, size)
+	pool.start()
+	start = time.perf_counter()
+	for event in events:
+		pool.submit(event)
+	for x in range(len(events)):
+		done.acquire()
+	elapsed = time.perf_counter() - start
+	pool.join(1)
+	ordered = all(seq == sorted(seq) for seq in seen.values())
+	return elapsed, ordered
+
+if __name__ == '__main__':
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+	users = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+	workers = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+	io = float(sys.argv[4]) / 1000 if len(sys.argv) > 4 else 0.002
+	events = [SendMessageEvent('msg_send', dict(user = 'U%s'%(x % users), seq = x, text = 'hi')) for x in range(count)]
+	for size in (1, workers):
+		elapsed, ordered = run(events, size, io)
+		print('workers=%-3s events=%s elapsed=%.2fs throughput=%.0f ev/s per-user order kept: %s'%(
+			size, count, elapsed, count / elapsed, ordered))
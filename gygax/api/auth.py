@@ -1,16 +1,17 @@
 import json
-import requests
 from ..util.config import config
 from ..util.log import getLogger
 from ..util.http import http
+from ..util.client import Client
 from ..app import agent
 from ..bot.events import SlackValidationEvent
 _log = getLogger('api.auth')
 
+client = Client.from_config('auth', config.api.client)
+
 def validate_user(slack):
 	_log.debug('Obtaining validation url for %s'%slack)
-	resp = requests.post(config.api.auth.validate,
-						params = dict(slack=slack))
+	resp = client.post(config.api.auth.validate, params = dict(slack=slack))
 	if resp.status_code == 200:
 		ok = resp.json().get('ok')
 		uid = resp.json().get('uid')
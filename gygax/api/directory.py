@@ -0,0 +1,83 @@
+from threading import Lock
+from collections import namedtuple
+from ..util.log import getLogger
+from ..util.metrics import metrics
+
+_log = getLogger('api.directory')
+
+'''
+	This module implements the local slack user directory.
+	Users are indexed in memory by id and by name, so lookups never touch the network,
+	and persisted to the slack_directory table, so a restart loads them instead of syncing.
+
+	A sync walks users.list page by page and compares each member, with its `updated` time,
+	to the entry it already has. Only new and changed members are indexed again and written,
+	a refresh of an unchanged workspace writes nothing.
+	Slack has no way to list only the users changed since a time, so every sync reads every page.
+'''
+
+Entry = namedtuple('Entry', ['slack_id', 'name', 'real_name', 'tz', 'deleted', 'updated'])
+
+def entry(member):
+	'''
+		The directory Entry of a users.list member
+	'''
+	return Entry(member['id'], member.get('name'),
+				member.get('real_name') or (member.get('profile') or {}).get('real_name'), member.get('tz'),
+				bool(member.get('deleted')), int(member.get('updated') or 0))
+
+class Directory:
+	def __init__(self):
+		self._by_id = dict()
+		self._by_name = dict()
+		self._lock = Lock()
+
+	def __len__(self):
+		return len(self._by_id)
+
+	def get(self, slack_id):
+		return self._by_id.get(slack_id)
+
+	def id(self, name):
+		'''
+			Returns the slack id of the user called `name`, None if there is none
+		'''
+		return self._by_name.get(name)
+
+	def _index(self, entries):
+		with self._lock:
+			for e in entries:
+				old = self._by_id.get(e.slack_id)
+				if old and self._by_name.get(old.name) == e.slack_id:
+					del self._by_name[old.name]
+				self._by_id[e.slack_id] = e
+				if e.name and not e.deleted:
+					self._by_name[e.name] = e.slack_id
+
+	def load(self):
+		'''
+			Loads the stored directory, returns the number of entries
+		'''
+		from .storage import load_directory
+		entries = [Entry(*row) for row in load_directory()]
+		self._index(entries)
+		return len(entries)
+
+	def sync(self, members):
+		'''
+			Indexes and stores the new and changed members from an iterable of users.list members.
+			Returns the number of changed entries
+		'''
+		from .storage import save_directory
+		changed = []
+		for member in members:
+			e = entry(member)
+			old = self._by_id.get(e.slack_id)
+			if old is None or old != e:
+				changed.append(e)
+		if changed:
+			self._index(changed)
+			save_directory(changed)
+		metrics.counter('directory_changes').inc(len(changed))
+		_log.debug('Directory sync found %s changed of %s users'%(len(changed), len(self._by_id)))
+		return len(changed)
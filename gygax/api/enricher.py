@@ -0,0 +1,162 @@
+from threading import Thread, Event, Lock
+from datetime import datetime
+import time
+from .slack import Slack
+from ..util.config import config
+from ..util.log import getLogger
+from ..util.metrics import metrics
+from ..util.time import convert_delta
+
+_log = getLogger('api.enricher')
+
+'''
+	This module fills in slack profiles in the background.
+	Slack rows are created with only the slack id, so registering a user
+	makes no slack api call and its transaction stays short.
+	Requested ids are collected for a `window` and looked up as a batch,
+	then written to the database in a single transaction.
+	Profiles come from the synced user directory when it has the user, from users.info otherwise,
+	and are cached for `ttl`, an id requested again within it is not looked up.
+	Ids whose lookup or write failed are queued again after a backoff, up to `retries` times.
+'''
+
+def profile(info):
+	'''
+		The slack row columns taken from a users.info user
+	'''
+	fields = info.get('profile') or {}
+	return dict(name = info.get('name'),
+				real_name = info.get('real_name') or fields.get('real_name'),
+				tz = info.get('tz'))
+
+class ProfileEnricher(Thread):
+	def __init__(self, window = 500, ttl = 3600, retries = 5, backoff = 2):
+		self._window = window / 1000.0
+		self._ttl = ttl
+		self._retries = retries
+		self._backoff = backoff
+		self._pending = set()
+		self._failed = dict()	# slack id -> (failed attempts, monotonic time it is retried)
+		self._cache = dict()
+		self._lock = Lock()
+		self._wakeup = Event()
+		self._exit = Event()
+		self._lookups = metrics.counter('profile_lookups')
+		self._hits = metrics.counter('profile_cache_hits')
+		self._directory_hits = metrics.counter('profile_directory_hits')
+		super().__init__(name = 'profile-enricher')
+		self.daemon = True
+
+	def request(self, slack_id):
+		'''
+			Queues a slack id to have its profile filled in
+		'''
+		with self._lock:
+			self._pending.add(slack_id)
+			if not self.is_alive() and not self._exit.is_set():
+				self.start()
+		self._wakeup.set()
+
+	def _cached(self, slack_id, now):
+		entry = self._cache.get(slack_id)
+		if entry and entry[0] > now:
+			self._hits.inc()
+			return entry[1]
+		return None
+
+	def _from_directory(self, slack_id):
+		from ..app import slack
+		entry = slack.directory.get(slack_id)
+		if entry is None:
+			return None
+		self._directory_hits.inc()
+		return dict(name = entry.name, real_name = entry.real_name, tz = entry.tz)
+
+	def _from_slack(self, slack_id):
+		self._lookups.inc()
+		try:
+			info = Slack._get_user_info(slack_id)
+		except Exception as e:
+			_log.error('Failed to look up slack profile of %s'%slack_id)
+			_log.exception(e)
+			return None
+		if not info:
+			_log.warning('Could not look up slack profile of %s'%slack_id)
+			return None
+		return profile(info)
+
+	def _lookup(self, ids):
+		'''
+			Returns the profiles found, by slack id, and the ids that could not be looked up
+		'''
+		now = time.monotonic()
+		profiles = dict()
+		failed = []
+		for slack_id in ids:
+			fields = self._cached(slack_id, now)
+			if fields is None:
+				fields = self._from_directory(slack_id) or self._from_slack(slack_id)
+				if fields is None:
+					failed.append(slack_id)
+					continue
+				self._cache[slack_id] = (now + self._ttl, fields)
+			profiles[slack_id] = dict(fields, updated = datetime.utcnow())
+		return profiles, failed
+
+	def _retry(self, filled, failed):
+		now = time.monotonic()
+		with self._lock:
+			for slack_id in filled:
+				self._failed.pop(slack_id, None)
+			for slack_id in failed:
+				attempts = self._failed.pop(slack_id, (0, None))[0] + 1
+				if attempts > self._retries:
+					_log.error('Giving up on the slack profile of %s after %s attempts'%(slack_id, attempts))
+					continue
+				self._failed[slack_id] = (attempts, now + self._backoff * 2 ** (attempts - 1))
+
+	def _next_retry(self):
+		'''
+			Seconds until the next failed id is due to be retried, None when there are none
+		'''
+		with self._lock:
+			if not self._failed:
+				return None
+			return max(min(due for attempts, due in self._failed.values()) - time.monotonic(), 0)
+
+	def flush(self):
+		from .storage import update_slack_profiles
+		now = time.monotonic()
+		with self._lock:
+			ids, self._pending = self._pending, set()
+			ids.update(slack_id for slack_id, (attempts, due) in self._failed.items() if due <= now)
+		if not ids:
+			return
+		try:
+			profiles, failed = self._lookup(ids)
+			if profiles:
+				update_slack_profiles(profiles)
+			_log.debug('Filled in %s of %s slack profiles'%(len(profiles), len(ids)))
+		except Exception as e:
+			_log.error('Failed to fill in slack profiles')
+			_log.exception(e)
+			profiles, failed = (), ids
+		self._retry(profiles, failed)
+
+	def run(self):
+		while not self._exit.is_set():
+			self._wakeup.wait(self._next_retry())
+			self._wakeup.clear()
+			self._exit.wait(self._window)	# Collect the ids requested during the window
+			self.flush()
+
+	def join(self, timeout = None):
+		self._exit.set()
+		self._wakeup.set()
+		if self.is_alive():
+			super().join(timeout)
+		self.flush()	# Ids requested while the thread was stopping
+
+enricher = ProfileEnricher(int(config.api.slack.profile.window),
+							convert_delta(config.api.slack.profile.ttl).total_seconds(),
+							int(config.api.slack.profile.retries), float(config.api.slack.profile.backoff))
@@ -1,15 +1,31 @@
 from ..util.pubsub import Subscriber
 from ..util.config import config
 from ..util.log import getLogger
+from ..util.schema import Schema, Field
+from ..util.client import Client, RETRY_STATUS
+from ..util.ratelimit import RateLimited
+from .directory import Directory
 from ..bot.events import MessageEvent, CommandEvent
-import requests
 import json
+from threading import Lock
 
 _log = getLogger('api.slack')
 
 auth_token = config.crypto.slack
 default_data = dict(token=auth_token)
 
+# Firehose payloads, slack caps message text at 40000 characters
+MESSAGE = Schema(
+	extra = True,
+	user = Field(str, max_len = 32),
+	channel = Field(str, max_len = 32),
+	text = Field(str, max_len = 40000),
+	public = Field(bool),
+)
+COMMAND = MESSAGE
+
+client = Client.from_config('slack', config.api.client)
+
 def build_url(ext):
 	return config.api.slack.base + ext
 
@@ -18,11 +34,51 @@ def reqOk(resp):
 		return True
 	return False
 
+class DMIndex:
+	'''
+		Maps slack users to their direct message channels and back
+	'''
+	def __init__(self):
+		self._by_user = dict()
+		self._by_channel = dict()
+		self._lock = Lock()
+
+	def __len__(self):
+		return len(self._by_user)
+
+	def channel(self, user):
+		return self._by_user.get(user)
+
+	def user(self, channel):
+		return self._by_channel.get(channel)
+
+	def update(self, pairs):
+		with self._lock:
+			for user, channel in pairs:
+				old = self._by_user.get(user)
+				if old:
+					self._by_channel.pop(old, None)
+				self._by_user[user] = channel
+				self._by_channel[channel] = user
+
+	def discard(self, user):
+		with self._lock:
+			channel = self._by_user.pop(user, None)
+			if channel:
+				self._by_channel.pop(channel, None)
+
 class Slack:
+	'''
+		Users are looked up in a Directory synced from users.list.
+		Direct message channels are kept in a DMIndex, persisted to the dm_channel table.
+		warm() loads it at startup, from the table, or the first time with a paged im.list,
+		after that an unknown user costs a single im.open
+	'''
 	def __init__(self):
 		self._events = None
-		self._user_map = {}
-		self._subscriber = Subscriber(config.api.firehose)
+		self._dms = DMIndex()
+		self.directory = Directory()
+		self._subscriber = Subscriber.from_config(config.api.firehose)
 
 		
 	def register_output_handler(self, events):
@@ -30,7 +86,14 @@ class Slack:
 		
 	def start(self):
 		self._subscriber.open()
-		self._setup_handlers()
+		self._setup_handlers(self._subscriber)
+
+	def attach(self, subscriber):
+		'''
+			Receives messages from another subscriber, like the asyncio agent's, instead of our own
+		'''
+		self._subscriber = subscriber
+		self._setup_handlers(subscriber)
 	
 	def stop(self):
 		self._subscriber._close()
@@ -45,56 +108,166 @@ class Slack:
 		_log.debug('Received command %s'%ev.cmd)
 		return self._events(ev) if self._events else None
 
-	def _setup_handlers(self):
-		self._subscriber.addHandler('msg', self._message_handler, strict = False)
-		self._subscriber.addHandler('cmd', self._command_handler, strict = False)
+	def _setup_handlers(self, subscriber):
+		subscriber.addHandler('msg', self._message_handler, schema = MESSAGE)
+		subscriber.addHandler('cmd', self._command_handler, schema = COMMAND)
 
 	@staticmethod
 	def _get_dms():
-		resp = requests.post(build_url(config.api.slack.dm_list),
-							data = default_data)
-		if resp.json().get('ok'):
-			return resp.json().get('ims')
+		'''
+			Yields every dm channel, one im.list page at a time
+		'''
+		data = dict(limit = int(config.api.slack.dm_page))
+		data.update(default_data)
+		while True:
+			resp = client.post(build_url(config.api.slack.dm_list), idempotent = True,
+								data = data)
+			if not reqOk(resp):
+				_log.error('Failed to list dm channels')
+				return
+			body = resp.json()
+			for dm in body.get('ims', []):
+				yield dm
+			cursor = body.get('response_metadata', {}).get('next_cursor')
+			if not cursor:
+				return
+			data['cursor'] = cursor
 
-	@staticmethod
-	def _get_dm_user(user):
-		for dm in Slack._get_dms():
-			if dm['user'] == user:
-				return dm['id']
-				
 	@staticmethod
 	def _get_user_info(user):
 		data = dict(user=user)
 		data.update(default_data)
-		resp = requests.post(build_url(config.api.slack.user_info),
+		resp = client.post(build_url(config.api.slack.user_info), idempotent = True,
 							data = data)
 		if resp.json() and resp.json().get('ok'):
 			return resp.json().get('user')
 		return None
 
 	@staticmethod
-	def _get_user_id(user):
-		resp = requests.post(build_url(config.api.slack.user_list),
-							data = default_data)
-		if resp.json().get('ok'):
-			users = resp.json().get('members')
-			for u in users:
-				if u['name'] == user:
-					return u['id']
-	
+	def _get_users():
+		'''
+			Yields every workspace member, one users.list page at a time
+		'''
+		data = dict(limit = int(config.api.slack.user_page))
+		data.update(default_data)
+		while True:
+			resp = client.post(build_url(config.api.slack.user_list), idempotent = True,
+								data = data)
+			if not reqOk(resp):
+				raise Exception('Failed to list slack users')	# A partial sync would look like deleted users
+			body = resp.json()
+			for member in body.get('members', []):
+				yield member
+			cursor = body.get('response_metadata', {}).get('next_cursor')
+			if not cursor:
+				return
+			data['cursor'] = cursor
+
+	def _get_user_id(self, user):
+		return self.directory.id(user)
+
+	def sync_directory(self):
+		'''
+			Updates the user directory from users.list, returns the number of changed users
+		'''
+		return self.directory.sync(Slack._get_users())
+
+	def warm(self):
+		'''
+			Loads the user directory and the dm index from the database,
+			or from slack when nothing is stored yet
+		'''
+		self._warm_directory()
+		self._warm_dms()
+
+	def _warm_directory(self):
+		try:
+			loaded = self.directory.load()
+		except Exception as e:
+			_log.error('Failed to load the stored user directory')
+			_log.exception(e)
+			loaded = 0
+		if loaded:
+			_log.debug('Loaded %s stored directory entries'%loaded)
+			return
+		try:
+			self.sync_directory()
+		except Exception as e:
+			_log.error('Failed to sync the user directory')
+			_log.exception(e)
+
+	def _warm_dms(self):
+		from .storage import load_dm_channels
+		try:
+			pairs = load_dm_channels()
+		except Exception as e:
+			_log.error('Failed to load stored dm channels')
+			_log.exception(e)
+			pairs = []
+		if pairs:
+			self._dms.update(pairs)
+			_log.debug('Loaded %s stored dm channels'%len(pairs))
+			return
+		pairs = []
+		try:
+			for dm in Slack._get_dms():
+				if dm.get('user'):
+					pairs.append((dm['user'], dm['id']))
+		except Exception as e:	# Channels missing from the index are opened with im.open when first used
+			_log.error('Failed to fetch dm channels from slack')
+			_log.exception(e)
+		self._dms.update(pairs)
+		self._save_dms(pairs)
+		_log.debug('Fetched %s dm channels from slack'%len(pairs))
+
+	@staticmethod
+	def _save_dms(pairs):
+		from .storage import save_dm_channels
+		if not pairs:
+			return
+		try:
+			save_dm_channels(pairs)
+		except Exception as e:
+			_log.error('Failed to store dm channels')
+			_log.exception(e)
+
+	def _open_dm(self, user):
+		'''
+			Looks up a user's dm channel with im.open, which returns the existing channel if there is one
+		'''
+		dm = Slack._create_dm(user)
+		if dm:
+			self._dms.update([(user, dm)])
+			self._save_dms([(user, dm)])
+		return dm
+
+	def _forget_dm(self, user):
+		from .storage import remove_dm_channel
+		self._dms.discard(user)
+		try:
+			remove_dm_channel(user)
+		except Exception as e:
+			_log.error('Failed to remove stored dm channel for %s'%user)
+			_log.exception(e)
+
+	def resolve_dms(self, users):
+		'''
+			Opens dm channels for the users not in the index yet
+		'''
+		for user in set(users):
+			if user and not self._dms.channel(user):
+				self._open_dm(user)
+
 	def _is_dm(self, channel):
-		if channel in self._user_map:
+		if self._dms.user(channel):
 			return True
-		for ch in Slack._get_dms():
-			if ch['id'] == channel:
-				return True
-		return False
+		return channel.startswith('D')	# Slack's dm channel ids all start with D
 
 	@staticmethod
 	def _create_dm(user):
 		data = dict(user=user)
 		data.update(default_data)
-		resp = requests.post(build_url(config.api.slack.dm_new),
+		resp = client.post(build_url(config.api.slack.dm_new), idempotent = True,
 							data = data)
 		if reqOk(resp):
 			return resp.json().get('channel', {}).get('id')
@@ -107,8 +280,12 @@ class Slack:
 			data['text'] = message
 		_log.debug(data)
 		data.update(default_data)
-		resp = requests.post(build_url(config.api.slack.post_msg),
+		resp = client.post(build_url(config.api.slack.post_msg),
 							data = data)
+		if resp.status_code == 429:
+			raise RateLimited(float(resp.headers.get('Retry-After', 1)), config.api.slack.post_msg)
+		if resp.status_code in RETRY_STATUS:	# Raised so outbound can retry it, slack did not post it
+			resp.raise_for_status()
 		_log.debug(resp.json())
 		if reqOk(resp):
 			return True
@@ -118,20 +295,15 @@ class Slack:
 		return Slack._send_message(channel, message, attach)
 
 	def dm(self, user_id, message = None, cached = True, attach = []):
-		dm = self._user_map.get(user_id)
+		dm = self._dms.channel(user_id)
 		if not dm:
 			cached = False
-			dm = Slack._get_dm_user(user_id)
-		if not dm:
-			dm = Slack._create_dm(user_id)
+			dm = self._open_dm(user_id)
 		if not dm:
 			raise Exception('could not create direct message.')
 		if not Slack._send_message(dm, message, attach):
-			if cached:
-				self._user_map.pop(user_id)
-				return dm(user_id, message, attach)
-			else:
-				return False
-		self._user_map[user_id] = dm
+			if cached:	# The channel may be stale, look it up again once
+				self._forget_dm(user_id)
+				return self.dm(user_id, message, cached = False, attach = attach)
+			return False
 		return True
-		
@@ -0,0 +1,15 @@
+from ..util.http import http
+from ..util.log import getLogger
+from ..util.metrics import metrics
+from ..app import agent
+_log = getLogger('api.status')
+
+@http.route('/status/queue')
+def _queue():
+	return agent.queue_stats
+
+@http.route('/metrics')
+def _metrics():
+	snap = metrics.snapshot()
+	snap['queue'] = agent.queue_stats
+	return snap
@@ -1,12 +1,13 @@
 from contextlib import contextmanager
-from ..models import User, Weapon, Location, Slack, Game, Hit, Schedule
+import json
+from ..models import User, Weapon, Location, Slack, Game, Hit, Schedule, DirectMessage, DirectoryEntry, OutboundPost
 from ..app import Session
 from ..util.log import getLogger
 from ..util.conv import make_list
 from ..bot.const import USER_STATUS as USTAT
 from ..bot.const import HIT_STATUS as HSTAT
 from ..util.config import config
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert
 
 _log = getLogger(__name__)
 
@@ -170,25 +171,118 @@ def create_hit(hitman, target, weapon, location):
 		h = Hit(hitman, target, weapon, location)
 		session.add(h)
 
-def load_schedule():
+def stream_schedule(chunk = 1000):
+	'''
+		Yields every scheduled event ordered by due time,
+		fetching `chunk` rows at a time instead of loading the whole table
+	'''
 	with session_scope() as session:
-		for e in session.query(Schedule).all():
-			yield e.event, e.delay, e.uuid, e.repeat, e.time	
+		query = session.query(Schedule.data, Schedule.delay, Schedule.uuid, Schedule.repeat, Schedule.time)
+		for data, delay, uuid, repeat, time in query.order_by(Schedule.time).yield_per(chunk):
+			yield Schedule.decode(data), delay, uuid, repeat, time
 
-def add_to_schedule(event, delay, key, repeat, time):
-	try:
-		with session_scope() as session:
-			s = Schedule(event, delay, key, repeat, time)
-			session.add(s)
-	except IntegrityError:
-		with session_scope() as session:
-			s = session.query(Schedule).filter_by(uuid = key).first()
-			s.event = event
-			s.delay = delay
-			s.repeat = repeat
-			s.time = time
-			session.add(s)
+def _upsert_schedule(session, rows):
+	stmt = insert(Schedule.__table__).values(rows)	# Rows must have unique keys, postgres refuses to update a row twice
+	stmt = stmt.on_conflict_do_update(index_elements = ['uuid'],
+								set_ = dict(data = stmt.excluded.data,
+											delay = stmt.excluded.delay,
+											repeat = stmt.excluded.repeat,
+											time = stmt.excluded.time))
+	session.execute(stmt)
 
-def remove_from_schedule(key):
+def flush_schedule(saved, removed, chunk = 1000):
+	'''
+		Writes a set of schedule changes in a single transaction.
+		`saved` is a list of (event, delay, key, repeat, time) tuples to upsert,
+		`removed` is a list of keys to delete
+	'''
 	with session_scope() as session:
-		session.query(Schedule).filter_by(uuid = key).delete()
\ No newline at end of file
+		for x in range(0, len(removed), chunk):
+			session.query(Schedule).filter(Schedule.uuid.in_(removed[x:x + chunk])).delete(synchronize_session = False)
+		rows = [Schedule.row(*s) for s in saved]
+		for x in range(0, len(rows), chunk):
+			_upsert_schedule(session, rows[x:x + chunk])
+
+
+def load_dm_channels():
+	'''
+		Returns every known (slack user, dm channel) pair
+	'''
+	with session_scope() as session:
+		return session.query(DirectMessage.slack_id, DirectMessage.channel).all()
+
+def save_dm_channels(pairs, chunk = 1000):
+	'''
+		Upserts (slack user, dm channel) pairs, a user's channel replaces any stored before
+	'''
+	rows = [dict(slack_id = user, channel = channel) for user, channel in dict(pairs).items()]
+	with session_scope() as session:
+		for x in range(0, len(rows), chunk):
+			channels = [r['channel'] for r in rows[x:x + chunk]]
+			session.query(DirectMessage).filter(DirectMessage.channel.in_(channels)).delete(synchronize_session = False)
+			stmt = insert(DirectMessage.__table__).values(rows[x:x + chunk])
+			session.execute(stmt.on_conflict_do_update(index_elements = ['slack_id'],
+										set_ = dict(channel = stmt.excluded.channel)))
+
+def remove_dm_channel(user):
+	with session_scope() as session:
+		session.query(DirectMessage).filter_by(slack_id = user).delete()
+
+def update_slack_profiles(profiles):
+	'''
+		Sets the profile fields of slack rows, `profiles` maps slack ids to dicts of column values
+	'''
+	with session_scope() as session:
+		for s in session.query(Slack).filter(Slack.slack_id.in_(list(profiles))):
+			for key, value in profiles[s.slack_id].items():
+				setattr(s, key, value)
+
+def load_directory():
+	'''
+		Returns every slack directory entry as a (slack_id, name, real_name, tz, deleted, updated) tuple
+	'''
+	with session_scope() as session:
+		query = session.query(DirectoryEntry.slack_id, DirectoryEntry.name, DirectoryEntry.real_name,
+								DirectoryEntry.tz, DirectoryEntry.deleted, DirectoryEntry.updated)
+		return [tuple(row) for row in query.all()]
+
+def save_directory(entries, chunk = 1000):
+	'''
+		Upserts directory entries, namedtuples with the table's columns, keyed on their slack id
+	'''
+	rows = [entry._asdict() for entry in entries]
+	with session_scope() as session:
+		for x in range(0, len(rows), chunk):
+			stmt = insert(DirectoryEntry.__table__).values(rows[x:x + chunk])
+			session.execute(stmt.on_conflict_do_update(index_elements = ['slack_id'],
+										set_ = dict(name = stmt.excluded.name,
+													real_name = stmt.excluded.real_name,
+													tz = stmt.excluded.tz,
+													deleted = stmt.excluded.deleted,
+													updated = stmt.excluded.updated)))
+
+def save_outbound(recipient, text, attachments):
+	'''
+		Stores an undelivered post for a ('user' or 'channel', id) recipient, returns its id
+	'''
+	kind, target = recipient
+	with session_scope() as session:
+		post = OutboundPost(kind = kind, target = target, text = text,
+							attachments = json.dumps(attachments) if attachments else None)
+		session.add(post)
+		session.flush()
+		return post.id
+
+def remove_outbound(id):
+	with session_scope() as session:
+		session.query(OutboundPost).filter_by(id = id).delete()
+
+def load_outbound():
+	'''
+		Returns the stored posts, oldest first, as (id, recipient, text, attachments) tuples
+	'''
+	with session_scope() as session:
+		query = session.query(OutboundPost.id, OutboundPost.kind, OutboundPost.target,
+								OutboundPost.text, OutboundPost.attachments)
+		return [(id, (kind, target), text, json.loads(attachments) if attachments else None)
+				for id, kind, target, text, attachments in query.order_by(OutboundPost.id)]
@@ -0,0 +1,90 @@
+from threading import Thread, Event, Lock
+from contextlib import contextmanager
+from .storage import flush_schedule
+from ..util.log import getLogger
+from ..util.time import convert_delta
+
+_log = getLogger('api.writebehind')
+
+'''
+	This module implements write-behind persistence for the schedule table.
+	Saves and removals are buffered per key, so an insert, update and delete
+	of the same key within a flush window collapse into the last one.
+	Buffered changes are written every `interval` in one transaction using bulk upserts.
+	With `flush: sync` every change is written immediately instead.
+'''
+
+class ScheduleWriter(Thread):
+	def __init__(self, flush = 'sync'):
+		self._sync = flush == 'sync'
+		self._deferred = 0
+		self._interval = None if self._sync else convert_delta(flush).total_seconds()
+		self._pending = dict()
+		self._lock = Lock()
+		self._flush_lock = Lock()
+		self._exit = Event()
+		super().__init__(name = 'schedule-writer')
+		self.daemon = True
+
+	def save(self, event, delay, key, repeat, time):
+		with self._lock:
+			self._pending[key] = (event, delay, key, repeat, time)
+		if self._sync and not self._deferred:
+			self.flush()
+
+	def remove(self, key):
+		with self._lock:
+			self._pending[key] = None
+		if self._sync and not self._deferred:
+			self.flush()
+
+	@contextmanager
+	def deferred(self):
+		'''
+			Buffers changes made inside the block, even in sync mode,
+			and writes them in one flush when it exits
+		'''
+		with self._lock:
+			self._deferred += 1
+		try:
+			yield self
+		finally:
+			with self._lock:
+				self._deferred -= 1
+			self.flush()
+
+	@property
+	def pending(self):
+		return len(self._pending)
+
+	def flush(self):
+		with self._flush_lock:	# Keeps flushes ordered, a later flush must not overtake an earlier one
+			with self._lock:
+				pending, self._pending = self._pending, dict()
+			if not pending:
+				return
+			saved = [s for s in pending.values() if s]
+			removed = [k for k, s in pending.items() if s is None]
+			try:
+				flush_schedule(saved, removed)
+				_log.debug('Flushed %s saved and %s removed schedule entries'%(len(saved), len(removed)))
+			except Exception as e:
+				_log.error('Failed to flush schedule, retrying next flush')
+				_log.exception(e)
+				with self._lock:
+					for key, s in pending.items():	# Newer changes win over the ones that failed
+						self._pending.setdefault(key, s)
+
+	def start(self):
+		if not self._sync:
+			super().start()
+
+	def run(self):
+		while not self._exit.wait(self._interval):
+			self.flush()
+
+	def join(self, timeout = None):
+		self._exit.set()
+		if self.is_alive():
+			super().join(timeout)
+		self.flush()
@@ -14,7 +14,10 @@ Base.metadata.bind = db
 from .api.slack import Slack
 slack = Slack()
 
-from .bot.agent import Agent
+if config.agent.mode == 'asyncio':
+	from .bot.aio import AsyncAgent as Agent
+else:
+	from .bot.agent import Agent
 
 agent = Agent()
 
@@ -22,6 +25,10 @@ slack.register_output_handler(agent.put)
 # agent.start()
 from .bot.action import all_actions
 agent.register_actions(all_actions)
+from .api import status
+if config.agent.mode == 'asyncio':
+	from .api import auth
+	agent.attach(slack, auth)
 # actions = [a(agent.proxy) for a in all_actions]
 
 # app.start()
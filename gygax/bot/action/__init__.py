@@ -3,7 +3,7 @@ from .command import	CommandAction, RegisterCommand, SetCommand, ReportCommand,
 from .ext import SlackAuthorizedAction
 from .game import *
 from .message import SendMessageAction, AssignmentNotifyAction, StructuredMessageAction, KillConfirmMessageAction
-from .user import UpdateUserAction, ValidateSlackAction, CollectInfoAction, NewUserAction
+from .user import UpdateUserAction, ValidateSlackAction, CollectInfoAction, NewUserAction, SyncDirectoryAction
 
 actions = dict(
 	commands = [
@@ -43,7 +43,8 @@ actions = dict(
 		UpdateUserAction,
 		ValidateSlackAction,
 		CollectInfoAction,
-		NewUserAction
+		NewUserAction,
+		SyncDirectoryAction
 	]
 )
 
@@ -16,9 +16,32 @@ _log = getLogger('action')
 		-	Action._process(self, event)
 			This method is called whenever a event matching this action is found.
 			It is passed the event and is expected to use push new events onto the queue using self._put().
+
+	Actions setting `batched = True` are handed every matching event from a drained batch at once,
+	through Action._process_batch(self, events), which defaults to handling each one in turn.
+
+	Actions setting `io_bound = True` run on the dispatcher's thread pool instead of the agent thread,
+	with at most `concurrency` calls in flight, calls for the same user still run in order.
+	Only mark actions whose work is independent of game state ordering.
+
+	Exceptions are reported to sentry and raised again, the dispatcher logs them and counts them
+	in handler_exceptions under the type and topic the action was registered for.
+	Batches for io bound actions are split into one call per user to keep that order,
+	actions setting `ordered = False` get each batch in one call instead.
 '''
 
+class BatchFailed(Exception):
+	'''
+		Raised once a batch has been handled when some of its events failed,
+		each failure has already been reported to sentry
+	'''
+	pass
+
 class Action:
+	batched = False
+	io_bound = False
+	ordered = True
+	concurrency = 1
 	def __init__(self, proxy, logger = None):
 		self._proxy = proxy
 		self.__log = logger
@@ -38,7 +61,22 @@ class Action:
 			events = self._process(msg)
 		except Exception:
 			SentryClient.captureException()
-			return False
+			raise
+		if isinstance(events, (list, tuple)) or isinstance(events, Event):
+			for e in make_list(events):
+				self._put(e)
+			return True
+		else:
+			return events
+
+	def batch(self, msgs):
+		try:
+			events = self._process_batch(msgs)
+		except BatchFailed:
+			raise
+		except Exception:
+			SentryClient.captureException()
+			raise
 		if isinstance(events, (list, tuple)) or isinstance(events, Event):
 			for e in make_list(events):
 				self._put(e)
@@ -53,6 +91,19 @@ class Action:
 		self._log.debug('Got message, Taking no action')
 		return True
 
+	def _process_batch(self, msgs):
+		handled = False
+		failed = 0
+		for msg in msgs:	# An event that fails does not stop the rest of the batch
+			try:
+				if self(msg):
+					handled = True
+			except Exception:
+				failed += 1
+		if failed:
+			raise BatchFailed('%s of %s events failed'%(failed, len(msgs)))
+		return handled
+
 	def _register(self, event, delay, key = None):
 		return self._proxy.register(event, delay , key)
 
@@ -5,6 +5,7 @@ from ..const import EVENT_TYPES as ETYPES
 from ..const import HIT_STATUS as HSTATUS
 from ..events import SlackValidationEvent, CommandEvent, SendMessageEvent, UpdateUserEvent, SetupGameEvent, StructuredMessageEvent, KillConfirmedEvent, ConfirmKillEvent
 from ...api.storage import create_user, get_user, get_hit, session_scope
+from ...api.enricher import enricher
 from ...util.config import config
 from ...models import Slack
 _log = getLogger('action.command')
@@ -20,7 +21,7 @@ class CommandAction(Action):
 
 	def _process(self, event):
 		self._log.debug('Processing raw command')
-		print(event.data())
+		self._log.debug(event.data())
 		if event.cmd_type == 'bang' and event.public:
 			self._log.debug('bang command on public channel')
 			return
@@ -46,6 +47,7 @@ class RegisterCommand(Action):
 					self._log.debug('user %s already in database'%event.user)
 					return SendMessageEvent('msg_send', dict(user=event.user, text=config.resp.already_registered))
 		create_user(slack = event.user)
+		enricher.request(event.user)
 		self._log.info('Created account for %s'%event.user)
 		return self._process(event)		
 
@@ -2,45 +2,69 @@ from ..const import EVENT_TYPES as ETYPES
 from ...util.log import getLogger
 from ...app import slack as SlackApi
 from .base import Action
-from ...api.storage import get_user
+from ...api.storage import get_user, save_outbound, remove_outbound
 from ..events import SendMessageEvent, StructuredMessageEvent
+from ..outbound import Outbound
 from ...util.config import config
 _log = getLogger('action.message')
 
+def _post(recipient, message, attach):
+	kind, target = recipient
+	if kind == 'channel':
+		return SlackApi.msg(target, message, attach or [])
+	return SlackApi.dm(target, message, attach = attach or [])
+
+def _recipient(event):
+	return ('channel', event.channel) if event.channel else ('user', event.user)
+
+# Shared by both message actions, so plain and structured messages to a user are merged together
+outbound = Outbound(_post, int(config.api.slack.coalesce.window), int(config.api.slack.coalesce.limit), int(config.api.slack.coalesce.threads),
+					rate = float(config.api.slack.delivery.rate), burst = int(config.api.slack.delivery.burst),
+					channel_rate = float(config.api.slack.delivery.channel_rate), channel_burst = int(config.api.slack.delivery.channel_burst),
+					retries = int(config.api.slack.delivery.retries), save = save_outbound, remove = remove_outbound)
+
 class SendMessageAction(Action):
 	log = _log
+	batched = True
+	io_bound = True
+	ordered = False	# One dm lookup per batch, a message may overtake one dispatched alone just before it
+	concurrency = 4
 	def _install(self, proxy):
 		proxy.register(ETYPES.MSG, 'msg_send', self)
 
+	def _process_batch(self, events):
+		SlackApi.resolve_dms([e.user for e in events if not e.channel])	# Opens channels for users not seen before
+		return super()._process_batch(events)
+
 	def _process(self, event):
 		self._log.debug('Received outbound message event to %s'%event.user)
 		if not event.text:
 			self._log.error('Outbound message has no text!')
 			return
-		if event.channel:
-			ok = SlackApi.msg(event.channel, event.text)
-		else:
-			ok = SlackApi.dm(event.user, event.text)
-		if ok:
-			self._log.debug('Successfully sent message to %s'%event.user)
+		if outbound.send(_recipient(event), event.text):
+			self._log.debug('Successfully queued message to %s'%event.user)
 		else:
 			self._log.debug('Failed to send message to %s'%event.user)
 
 class StructuredMessageAction(Action):
+	batched = True
+	io_bound = True
+	ordered = False
+	concurrency = 4
 	def _install(self, proxy):
 		proxy.register(ETYPES.MSG, 'msg_structured', self)
 
+	def _process_batch(self, events):
+		SlackApi.resolve_dms([e.user for e in events if not e.channel])
+		return super()._process_batch(events)
+
 	def _process(self, event):
 		self._log.debug('Received outbound stuctured message event to %s'%event.user)
 		if not event.attachments:
 			self._log.error('Stuctured message has no body!')
 			return
-		if event.channel:
-			ok = SlackApi.msg(event.channel, attach = event.attachments, message = event.text)
-		else:
-			ok = SlackApi.dm(event.user, attach = event.attachments, message = event.text)
-		if ok:
-			self._log.debug('Successfully sent structured message to %s'%event.user)
+		if outbound.send(_recipient(event), event.text, event.attachments):
+			self._log.debug('Successfully queued structured message to %s'%event.user)
 		else:
 			self._log.debug('Failed to send structured message to %s'%event.user)
 
@@ -3,9 +3,10 @@ from .base import Action
 from ..const import CMD_TYPES as CTPYES
 from ..const import EVENT_TYPES as ETYPES
 from ..const import USER_STATUS as USTAT
-from ..events import SendMessageEvent, UserRegisteredEvent, CollectInfoEvent, UserUpdatedEvent, StructuredMessageEvent
+from ..events import SendMessageEvent, UserRegisteredEvent, CollectInfoEvent, UserUpdatedEvent, StructuredMessageEvent, SyncDirectoryEvent
 from ...api.storage import validate_slack, set_weapon, set_location, info_locked, profile_is_complete, check_profile_completion, set_status, get_user
 from ...api import auth as AuthApi
+from ...app import slack as SlackApi
 from ...util.config import config
 
 _log = getLogger('action.user')
@@ -43,6 +44,8 @@ class ValidateSlackAction(Action):
 		if so it querys the auth service for a validation url,
 		then push a message to the slack user containg the url
 	'''
+	io_bound = True
+	concurrency = 4
 	def _install(self, proxy):
 		proxy.register(ETYPES.USER, 'user_validate', self)
 
@@ -101,4 +104,17 @@ class NewUserAction(Action):
 
 	def _process(self, event):
 		set_status(event.user, USTAT.FREE)
-		return [SendMessageEvent('msg_send', dict(user=event.user, text=config.resp.new_user))]
\ No newline at end of file
+		return [SendMessageEvent('msg_send', dict(user=event.user, text=config.resp.new_user))]
+
+class SyncDirectoryAction(Action):
+	'''
+		Refreshes the slack user directory every `api.slack.directory_sync`
+	'''
+	io_bound = True
+	def _install(self, proxy):
+		proxy.register(ETYPES.CRON, 'cron_sync_directory', self)
+		proxy.schedule(SyncDirectoryEvent('cron_sync_directory'), config.api.slack.directory_sync, 'cron_sync_directory', repeat = True)
+
+	def _process(self, event):
+		changed = SlackApi.sync_directory()
+		self._log.debug('Directory sync updated %s users'%changed)
@@ -1,13 +1,22 @@
-from threading import Thread, Event, Timer, RLock
-from queue import Queue, Empty
+from threading import Thread, Event, RLock
+from queue import Empty
 from .dispatch import Dispatcher, Proxy
+from .workers import WorkerPool
+from .lanes import LaneQueue
+from .misfire import MisfirePolicy
+from .journal import Journal
 from ..util.log import getLogger
 from ..util.config import config
 from ..util.crypto import rand_key
+from ..util.scheduler import Scheduler
+from ..util.metrics import metrics
 from ..util.time import convert_delta, is_delta, is_walltime, secs_until, to_datetime
-from ..api.storage import load_schedule, add_to_schedule, remove_from_schedule
+from ..api.storage import stream_schedule
+from ..api.writebehind import ScheduleWriter
 from .const import TIMER_TYPE as TTYPE
+from .const import event_repr
 from datetime import datetime
+from time import monotonic
 # from .action import all_actions
 from ..api.slack import Slack
 
@@ -15,34 +24,60 @@ _log = getLogger('bot.agent')
 
 class Agent(Thread):
 	def __init__(self):
-		self._events = Queue()
-		self._dispatch = Dispatcher()
+		self._events = LaneQueue(config.agent.lanes, config.agent.queue.policies, config.agent.queue.default, self._done)
+		self._dispatch = self._dispatcher(int(config.agent.executor.threads))
 		self._proxy = Proxy(self._dispatch, self.put, self.schedule, self.cancel)
 		self._running = Event()
 		self._scheduled = dict()
-		self._pending = dict()
+		self._timers = self._scheduler()
+		self._store = ScheduleWriter(config.storage.schedule.flush)
+		self._misfire = MisfirePolicy(config.agent.misfire.policies, config.agent.misfire.default, config.agent.misfire.limit)
+		workers = int(config.agent.workers)
+		self._workers = WorkerPool(self._handle, workers) if workers > 1 else None
 		self._schedule_lock = RLock()
+		self._batch = max(int(config.agent.batch), 1)
+		journal = config.agent.journal
+		self._journal = Journal(journal.path, journal.segment_size, journal.fsync, journal.keep) if journal.path else None
 		super().__init__()
 
+	def _dispatcher(self, threads):
+		return Dispatcher(threads)
+
+	def _scheduler(self):
+		return Scheduler()
+
 	def _get(self):
 		try:
-			return self._events.get(True, 1)
+			return self._events.get_batch(self._batch, True, 1)
 		except Empty:
 			pass
 		return None
 	
 	def put(self, event):
-		self._events.put(event)
+		event._queued = monotonic()
+		if self._journal:
+			self._journal.record(event)
+		self._enqueue(event)
+
+	def _enqueue(self, event):
+		if not self._events.put(event):
+			_log.debug('Queue full, shed event type: %s, topic: %s'%(event.type, event.topic))
+			self._done(event)
+
+	def _done(self, event):
+		if self._journal:
+			self._journal.done(event)
+
+	def _waited(self, event, now):
+		queued = getattr(event, '_queued', None)
+		if queued:
+			metrics.histogram('queue_wait', event_repr(event.type), event.topic).observe(now - queued)
 
 	def cancel(self, key):
 		try:
-			remove_from_schedule(key)
+			self._store.remove(key)
 			self._scheduled.pop(key, None)
-			timer = self._pending.pop(key, None)
-			if timer:
-				timer.cancel()
-				return True
-			return False
+			return self._timers.cancel(key)
 		except Exception as e:
 			_log.error('Error removing key %s'%key)
 			_log.exception(e)
@@ -58,7 +93,7 @@ class Agent(Thread):
 		if persist:
 			self._save_event(event, time, key, repeat, delay)
 		with self._schedule_lock:
-			if not key in self._pending:
+			if not key in self._timers:
 				if repeat:
 					self._scheduled[key] = (event, time)
 				return self._schedule_event(event, delay, key)
@@ -68,52 +103,82 @@ class Agent(Thread):
 	def _schedule_event(self, event, time, key):
 		secs = secs_until(time)
 		_log.debug('Scheduling event %s at %s, sleeping %s seconds'%(event, time, secs))
-		timer = Timer(secs, self._on_schedule, (event, key))
-		with self._schedule_lock:
-			self._pending[key] = timer
-		if self._running.isSet():
-			timer.start()
-		return key
+		return self._timers.schedule(key, secs, self._on_schedule, event, key)
 
 	def _on_schedule(self, event, key):
 		self.put(event)
 		with self._schedule_lock:
-			self._pending.pop(key, None)
-			remove_from_schedule(key)
+			self._store.remove(key)
 			repeat = self._scheduled.pop(key, None)
 		if repeat:
 			self.schedule(*repeat, key, repeat = True)
 
 	def _save_event(self, event, delay, key, repeat, time):
-		add_to_schedule(event, delay, key, repeat, time)
+		self._store.save(event, delay, key, repeat, time)
 	
 	def _load_schedule(self):
-		with self._schedule_lock:
-			for event, delay, key, repeat, time in load_schedule():
-				_log.debug('Loading scheduled event %s, at %s repeat: %s'%(event, time, repeat))
-				if time > datetime.now():
-					self._schedule_event(event, time, key)
-					if repeat:
-						self._scheduled[key] = (event, delay)
-				else:
-					self.schedule(event, delay, key, repeat, persist = False)
+		'''
+			Restores persisted events in due order.
+			Events that came due while we were down are handled by their misfire policy,
+			and any rescheduled rows are written back in a single flush
+		'''
+		start = monotonic()
+		now = datetime.utcnow()
+		restored = fired = dropped = 0
+		with self._schedule_lock, self._store.deferred():
+			for event, delay, key, repeat, time in stream_schedule():
+				fires, due = self._misfire.plan(key, time, delay, repeat, now)
+				for x in range(fires):
+					self.put(event)
+				fired += fires
+				if due is None:
+					self._store.remove(key)
+					dropped += 1
+					continue
+				if due != time:
+					self._store.save(event, delay, key, repeat, due)
+				self._schedule_event(event, due, key)
+				if repeat:
+					self._scheduled[key] = (event, delay)
+				restored += 1
+		_log.info('Restored %s scheduled events in %.2fs, fired %s missed runs, dropped %s'%(
+					restored, monotonic() - start, fired, dropped))
 
 	@property
 	def proxy(self):
 		return self._proxy
+
+	@property
+	def queue_stats(self):
+		return self._events.stats
 		
 	def _handle(self, event):
 		_log.debug(event)
 		_log.debug('Handling event type: %s, topic: %s'%(event.type, event.topic))
-		handled = self._dispatch(event)
+		self._waited(event, monotonic())
+		handled = self._dispatch(event, self._done if self._journal else None)	# Done once io bound handlers finish
 		if not handled:
 			_log.debug('No handlers were found for event')
+
+	def _handle_batch(self, events):
+		_log.debug('Handling batch of %s events'%len(events))
+		if len(events) == 1:
+			return self._handle(events[0])
+		now = monotonic()
+		for event in events:
+			self._waited(event, now)
+		self._dispatch.batch(events, self._done if self._journal else None)
 	
 	def register_actions(self, actions):
 		self.__actions = actions
 
 	def _setup(self):
+		if self._journal:	# Opened first, missed runs fired while loading the schedule are journaled
+			for event in self._journal.open():
+				_log.info('Replaying unfinished event type: %s, topic: %s'%(event.type, event.topic))
+				self._enqueue(event)
 		self._load_schedule()
+		self._store.start()
 		self.__action_inst = [action(self.proxy) for action in self.__actions]
 		self._running.set()
 
@@ -123,17 +188,29 @@ class Agent(Thread):
 
 	def run(self):
 		_log.debug('Starting agent, waiting for events...')
-		with self._schedule_lock:		
-			for timer in self._pending.values():
-				timer.start()
+		self._timers.start()
+		if self._workers:
+			self._workers.start()
 		while self._running.isSet():
-			event = self._get()
-			if event:
+			events = self._get()
+			if events:
 				_log.debug('A wild Event appeared!')
-				self._handle(event)
+				if self._workers:
+					for event in events:
+						self._workers.submit(event)
+				else:
+					self._handle_batch(events)
 		_log.debug('Exiting.')
 
 	def join(self, timeout = 0):
 		self._running.clear()
-		self._slack.join()
-		return super().join(timeout)
\ No newline at end of file
+		self._timers.join(timeout)
+		self._store.join(timeout)
+		if self._workers:
+			self._workers.join(timeout)
+		ret = super().join(timeout)
+		if not self._dispatch.shutdown(wait = True, timeout = timeout):
+			_log.warning('Io bound handlers were still running at shutdown, their events will be replayed')
+		if self._journal:	# Closed last, handlers that finish later can no longer mark their events done
+			self._journal.close()
+		return ret
\ No newline at end of file
@@ -0,0 +1,138 @@
+import asyncio
+from functools import partial
+from queue import Empty
+from .agent import Agent
+from .dispatch import LoopDispatcher
+from ..util.log import getLogger
+from ..util.config import config
+from ..util.http import http
+from ..util.pubsub import AsyncSubscriber
+from ..util.scheduler import LoopScheduler, on_loop
+
+_log = getLogger('bot.aio')
+
+'''
+	This module implements an agent running on a single asyncio event loop.
+	The firehose subscriber, the http routes, timers and the dispatch of queued events
+	all share the loop's thread, so an idle agent sleeps until there is work
+	instead of polling its queue, sockets and server every second.
+
+	Existing Actions run unchanged: plain actions are called on the loop,
+	io_bound actions still run on the dispatcher's executor, and events they push
+	from there are handed back to the loop. Handlers that are coroutine functions
+	are started as tasks on the loop, and can use the async slack and auth clients.
+	Anything called on the loop must not block, use `flush: 1s` for the schedule store.
+'''
+
+class AsyncClient:
+	'''
+		Exposes the functions of a blocking client as coroutines,
+		run on the loop's default executor so they never stall the loop
+	'''
+	def __init__(self, client, loop):
+		self._client = client
+		self._loop = loop
+
+	def __getattr__(self, name):
+		attr = getattr(self._client, name)
+		if not callable(attr):
+			return attr
+		async def call(*args, **kwargs):
+			return await self._loop.run_in_executor(None, partial(attr, *args, **kwargs))
+		return call
+
+class AsyncAgent(Agent):
+	def __init__(self):
+		self._loop = asyncio.new_event_loop()
+		super().__init__()
+		self._firehose = None
+		self._wakeup = None
+		self._signalled = False
+		self.slack = None
+		self.auth = None
+
+	def _dispatcher(self, threads):
+		return LoopDispatcher(self._loop, threads)
+
+	def _scheduler(self):
+		return LoopScheduler(self._loop)
+
+	def attach(self, slack, auth = None):
+		'''
+			Receives the slack firehose on the loop and sets up the async clients
+		'''
+		self._firehose = AsyncSubscriber.from_config(config.api.firehose)
+		slack.attach(self._firehose)
+		self.slack = AsyncClient(slack, self._loop)
+		if auth:
+			self.auth = AsyncClient(auth, self._loop)
+
+	def _enqueue(self, event):
+		super()._enqueue(event)
+		self._wake()
+
+	def _wake(self):
+		if on_loop(self._loop):
+			self._wakeup.set()
+		elif self._loop.is_running():
+			if not self._signalled:	# One pending wakeup is enough however many events arrive
+				self._signalled = True
+				self._loop.call_soon_threadsafe(self._signal)
+
+	def _signal(self):
+		self._signalled = False
+		if self._wakeup:
+			self._wakeup.set()
+
+	async def _drain(self):
+		while self._running.is_set():
+			await self._wakeup.wait()
+			self._wakeup.clear()
+			while self._running.is_set():
+				try:
+					events = self._events.get_batch(self._batch, False)
+				except Empty:
+					break
+				if self._workers:
+					for event in events:
+						self._workers.submit(event)
+				else:
+					self._handle_batch(events)
+				await asyncio.sleep(0)	# Let sockets and timers in between batches
+
+	async def _main(self):
+		self._wakeup = asyncio.Event()
+		self._wakeup.set()	# Drain anything queued before the loop started
+		tasks = []
+		if self._firehose:
+			self._firehose.open()
+			tasks.append(self._loop.create_task(self._firehose.watch()))
+		server = await http.serve()
+		try:
+			await self._drain()
+		finally:
+			server.close()
+			if self._firehose:
+				self._firehose._close()
+			for task in tasks:
+				task.cancel()
+			await asyncio.gather(*tasks, return_exceptions = True)
+			await server.wait_closed()
+
+	def run(self):
+		_log.debug('Starting asyncio agent, waiting for events...')
+		asyncio.set_event_loop(self._loop)
+		self._timers.start()
+		if self._workers:
+			self._workers.start()
+		try:
+			self._loop.run_until_complete(self._main())
+		finally:
+			self._loop.close()
+		_log.debug('Exiting.')
+
+	def join(self, timeout = 0):
+		self._running.clear()
+		if self._loop.is_running():
+			self._loop.call_soon_threadsafe(self._signal)
+		return super().join(timeout)
@@ -0,0 +1,65 @@
+import json
+import pickle
+from . import events
+from .dispatch import Event
+from ..util.log import getLogger
+
+_log = getLogger('bot.codec')
+
+'''
+	This module implements a compact, versioned encoding for stored events.
+	An encoded event is a compact json array of [version, type tag, topic, data],
+	where the tag is the event's class name.
+	Event classes are looked up through a registry instead of an import path,
+	so moving a class between modules does not break stored events.
+	Blobs written by pickle are still decoded, to support rows written before this format.
+'''
+
+VERSION = 1
+_PICKLE = b'\x80'
+_dumps = json.JSONEncoder(separators = (',', ':')).encode
+_loads = json.JSONDecoder().raw_decode
+
+_classes = {}
+_tags = {}
+
+class UnknownEvent(Exception):
+	pass
+
+def register(cls, tag = None):
+	tag = tag if tag else cls.__name__
+	if tag in _classes and not _classes[tag] is cls:
+		raise ValueError('Event tag %s is already registered to %s'%(tag, _classes[tag]))
+	_classes[tag] = cls
+	_tags[cls] = tag
+	return cls
+
+def encode(event):
+	tag = _tags.get(event.__class__)
+	if tag is None:
+		raise UnknownEvent('%s is not a registered event class'%event.__class__.__name__)
+	data = event._data
+	if not type(data) is dict:	# A view forwarded from another event
+		data = dict(data)
+	return _dumps([VERSION, tag, event.topic, data]).encode()
+
+def decode(blob):
+	if not blob:
+		return None
+	if blob[:1] == _PICKLE:
+		return pickle.loads(blob)
+	(version, tag, topic, data), end = _loads(str(blob, 'utf-8'))	# psycopg2 hands back a memoryview
+	if version != VERSION:
+		raise ValueError('Unsupported event encoding version %s'%version)
+	cls = _classes.get(tag)
+	if cls is None:
+		raise UnknownEvent('No event class registered for %s'%tag)
+	return cls._restore(topic, data)
+
+def is_legacy(blob):
+	return bytes(blob[:1]) == _PICKLE
+
+register(Event)
+for obj in list(vars(events).values()):
+	if isinstance(obj, type) and issubclass(obj, Event):
+		register(obj)
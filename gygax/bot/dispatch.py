@@ -1,23 +1,85 @@
-from queue import Queue
 from .const import EVENT_TYPES as ETYPES
-from collections import defaultdict
-from threading import Lock, Timer, Thread
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from types import MappingProxyType
+from threading import Lock, Condition
+from zlib import crc32
+import asyncio
+from time import perf_counter
 from ..util.log import getLogger
+from ..util.metrics import metrics
+from ..util.scheduler import on_loop
 
 _log = getLogger('dispatch')
 
+class Field:
+	'''
+		A read only event attribute backed by the event's payload.
+		Fields are declared on the class, so they cost nothing per event
+	'''
+	__slots__ = ('key', 'default')
+	def __init__(self, key, default = None):
+		self.key = key
+		self.default = default
+
+	def __get__(self, event, cls):
+		if event is None:
+			return self
+		return event._data.get(self.key, self.default)
+
+_EMPTY = MappingProxyType({})
+
 class Event:
+	'''
+		Events are slotted, subclasses must declare `__slots__ = ()`.
+		The payload is never changed in place, _set() and data() replace it with an updated copy,
+		so data() can hand out a read only view of it for forwarding instead of a copy.
+	'''
+	__slots__ = ('_topic', '_data', '_journal_id', '_queued')
 	type = ETYPES.BASE
-	def __init__(self, topic, data = {}):
+	def __init__(self, topic, data = None):
 		self._topic = topic
-		self._data = data
+		self._data = _EMPTY if data is None else data
+		self._journal_id = None
+		self._queued = None
+
+	@classmethod
+	def _restore(cls, topic, data):
+		'''
+			Rebuilds an event from its stored topic and data, bypassing any parsing in __init__
+		'''
+		event = cls.__new__(cls)
+		Event.__init__(event, topic, data)
+		return event
+
+	def __getstate__(self):
+		'''
+			Pickles the payload as a plain dict, the read only views it may be held in can not be pickled
+		'''
+		return {'_topic': self._topic, '_data': dict(self._data)}
+
+	def __setstate__(self, state):
+		'''
+			Restores events pickled before events were slotted
+		'''
+		Event.__init__(self, None)
+		if isinstance(state, tuple):
+			state = dict(state[0] or {}, **(state[1] or {}))
+		for key, value in state.items():
+			setattr(self, key, value)
 
 	def _get(self, key, default = None):
 		return self._data.get(key, default)
 
 	def _set(self, key, value):
-		self._data[key] = value
-		
+		self._update({key: value})
+
+	def _update(self, values):
+		data = dict(self._data)
+		data.update(values)
+		self._data = data
+
 	@property
 	def topic(self):
 		return self._topic
@@ -28,14 +90,24 @@ class Event:
 
 	def data(self, data = None, overwrite = False):
 		if not data and  not overwrite:
-			return self._data.copy()
+			if type(self._data) is MappingProxyType:
+				return self._data
+			return MappingProxyType(self._data)
 		data = data if not data is None else {}
 		if overwrite:
 			self._data = data
 		else:
-			self._data.update(data)
+			self._update(data)
 			
 
+def partition_key(event):
+	'''
+		The key events are ordered by, the user an event concerns or the game for game events
+	'''
+	if event.type == ETYPES.GAME:
+		return event._get('game')
+	return event._get('user')
+
 class Proxy:
 	def __init__(self, disp, queue, schedule, cancel):
 		self.__disp = disp
@@ -59,60 +131,319 @@ class Proxy:
 	def cancel(self, *args):
 		return self.__cancel(*args)
 
-class Async(Thread):
-	def __init__(self, *args, callback = None, key = None, **kwargs):
-		super().__init__(*args, **kwargs)
-		self._callback = callback
-		self._key = key
+class Countdown:
+	'''
+		Calls `fn` once every call started for an event has finished.
+		The dispatcher holds it while routing the event and releases it afterwards,
+		each io bound call holds it until the call completes
+	'''
+	__slots__ = ('_count', '_lock', '_fn')
+	def __init__(self, fn):
+		self._count = 1
+		self._lock = Lock()
+		self._fn = fn
+
+	def hold(self):
+		with self._lock:
+			self._count += 1
+
+	def release(self):
+		with self._lock:
+			self._count -= 1
+			if self._count:
+				return
+		self._fn()
 
-	def run(self):
-		super().run()
-		self._callback(self)
+def _release(pending):
+	for p in pending:
+		p.release()
+
+class Executor:
+	'''
+		Runs io bound handlers on a bounded thread pool.
+		Each handler declares a `concurrency` cap, its calls are spread over that many
+		serial chains by the event's user or game, so a handler never runs more than
+		`concurrency` calls at once and calls for the same user still run in order.
+		Events returned by an Action are pushed back onto the queue by the Action itself,
+		the completion callback releases the chain, reports failures and calls the call's `done`.
+		Calls dropped at shutdown never call `done`, so their events are replayed from the journal.
+	'''
+	def __init__(self, threads):
+		self._pool = ThreadPoolExecutor(max_workers = threads)
+		self._lock = Condition()
+		self._running = set()
+		self._waiting = dict()
+
+	def submit(self, handler, key, fn, *args, done = None):
+		chain = (handler, crc32(str(key).encode()) % max(int(getattr(handler, 'concurrency', 1)), 1))
+		with self._lock:
+			if chain in self._running:
+				self._waiting.setdefault(chain, deque()).append((fn, args, done))
+				return
+			self._running.add(chain)
+		self._start(chain, fn, args, done)
+
+	def _start(self, chain, fn, args, done):
+		try:
+			future = self._pool.submit(fn, *args)
+		except RuntimeError:
+			_log.error('Executor is shut down, dropping call to %s'%chain[0])
+			with self._lock:
+				self._waiting.pop(chain, None)
+				self._running.discard(chain)
+				self._lock.notify_all()
+			return
+		future.add_done_callback(partial(self._finished, chain, done))
+
+	def _finished(self, chain, done, future):
+		if future.exception():
+			_log.error('Async handler %s threw an exception'%chain[0])
+			_log.exception(future.exception())
+		if done:
+			try:
+				done()
+			except Exception as e:
+				_log.error('Completion callback for %s threw an exception'%chain[0])
+				_log.exception(e)
+		with self._lock:
+			waiting = self._waiting.get(chain)
+			if waiting:
+				fn, args, done = waiting.popleft()
+			else:
+				self._waiting.pop(chain, None)
+				self._running.discard(chain)
+				self._lock.notify_all()
+				return
+		self._start(chain, fn, args, done)
+
+	@property
+	def pending(self):
+		with self._lock:
+			return len(self._running) + sum(len(w) for w in self._waiting.values())
+
+	def shutdown(self, wait = True, timeout = None):
+		'''
+			With `wait` set, queued calls are finished first, for at most `timeout` seconds.
+			Returns False when calls were still running
+		'''
+		finished = False
+		if wait:
+			with self._lock:
+				finished = self._lock.wait_for(lambda: not self._running, timeout)
+		self._pool.shutdown(finished)
+		return finished
 
 
 class Dispatcher:
 	'''
 		this object manages a list of handlers and associated
 		topics, which it uses to dispatch incoming events
+
+		Handlers are compiled into a routing table of immutable tuples keyed on (type, topic),
+		with the wildcard handlers for a type already appended.
+		register() builds a new table and swaps it in, so dispatching
+		never takes a lock and does not allocate.
+
+		Given a `done` callback, the dispatcher calls it with each event once all of the event's
+		handlers have finished, after any io bound calls for it complete on the executor.
 	'''
-	def __init__(self):
-		self._handlers = defaultdict(lambda: defaultdict(list))
+	def __init__(self, threads = 0):
+		self._handlers = dict()
+		self._table = (dict(), dict())	# (routes, wildcards), replaced as a whole on register
 		self.__lock = Lock()
-		self._pending = []
+		self._executor = Executor(threads) if threads else None
 	
-	def __call__(self, event):
-		return self._handle(event)
+	def __call__(self, event, done = None):
+		return self._handle(event, done)
+
+	def batch(self, events, done = None):
+		return self._handle_batch(events, done)
+
+	def _route(self, event):
+		routes, wildcards = self._table
+		route = routes.get((event.type, event.topic))
+		if route is None:
+			return wildcards.get(event.type, ())
+		return route
+
+	def _call(self, entry, arg, batch = False):
+		handler, latency, errors = entry
+		start = perf_counter()
+		try:
+			if batch:
+				handler.batch(arg)
+			else:
+				handler(arg)
+			return True
+		except Exception as e:
+			errors.inc()
+			_log.error('Handler %s threw an exception'%handler)
+			_log.exception(e)
+			return False
+		finally:
+			latency.observe(perf_counter() - start)
 
-	def _handle(self, event):
+	def _run(self, entry, event, pending = None):
+		if self._executor and getattr(entry[0], 'io_bound', False):
+			if pending:
+				pending.hold()
+			self._executor.submit(entry[0], partition_key(event), self._call, entry, event,
+									done = pending.release if pending else None)
+			return True
+		return self._call(entry, event)
+
+	def _handle(self, event, done = None):
+		pending = Countdown(partial(done, event)) if done else None
 		found = False
-		_log.debug('Handling event type: %s, topic: %s'%(ETYPES._fields[event.type], event.topic))
-		with self.__lock:
-			for handler in self._handlers[event.type][event.topic]:
-				_log.debug('Executing handler %s'%handler)
-				# action = Async(target=handler, args=(event,), callback=self._cleanup)
-				# self._pending.append(action)
-				# action.start()
-				try:
-					handler(event)
+		for entry in self._route(event):
+			if self._run(entry, event, pending):
+				found = True
+		if pending:
+			pending.release()
+		return found
+
+	def _handle_batch(self, events, done = None):
+		'''
+			Dispatches a batch of events in order.
+			Handlers with `batched` set are called once with all of their matching events
+			after the rest of the batch has been dispatched
+		'''
+		found = False
+		batches = OrderedDict()
+		pending = [Countdown(partial(done, event)) for event in events] if done else None
+		for x, event in enumerate(events):
+			p = pending[x] if pending else None
+			for entry in self._route(event):
+				if getattr(entry[0], 'batched', False):
+					batches.setdefault(entry, []).append((event, p))
+					found = True
+				elif self._run(entry, event, p):
 					found = True
-				except Exception as e:
-					_log.error('Handler for event %s %s threw an exception'%(event.type, event.topic))
-					_log.exception(e)
-			if not event.topic == None:
-				for handler in self._handlers[event.type][None]:
-					handler(event)
+		for entry, batch in batches.items():
+			_log.debug('Executing batched handler %s with %s events'%(entry[0], len(batch)))
+			self._run_batch(entry, batch)
+		if pending:
+			_release(pending)
 		return found
 
-	def _cleanup(self, action):
-		with self.__lock:
-			if action in self._pending:
-				self._pending.remove(action)
+	def _run_batch(self, entry, batch):
+		'''
+			Calls a batched handler with a list of (event, Countdown) pairs
+		'''
+		if self._executor and getattr(entry[0], 'io_bound', False):
+			self._submit_batch(entry, batch)
+		else:
+			self._call(entry, [event for event, p in batch], True)
+
+	def _submit_batch(self, entry, batch):
+		'''
+			Submits an io bound batched handler once per user or game in the batch,
+			so its calls share the chains of the handler's single events and stay in order.
+			Handlers with `ordered` unset get the whole batch in one call on a chain of its own,
+			keeping one bulk call per batch at the cost of ordering against their single events
+		'''
+		if getattr(entry[0], 'ordered', True):
+			parts = OrderedDict()
+			for event, p in batch:
+				parts.setdefault(partition_key(event), []).append((event, p))
+		else:
+			parts = {None: batch}
+		for key, part in parts.items():
+			held = [p for event, p in part if p]
+			for p in held:
+				p.hold()
+			self._executor.submit(entry[0], key, self._call, entry, [event for event, p in part], True,
+									done = partial(_release, held) if held else None)
+
+	@staticmethod
+	def _entry(type, topic, handler):
+		'''
+			A routing table entry, the handler with its latency histogram and exception counter
+		'''
+		name = getattr(handler, '__name__', None) or handler.__class__.__name__
+		labels = (ETYPES._fields[type], topic, name)
+		return (handler, metrics.histogram('handler_latency', *labels), metrics.counter('handler_exceptions', *labels))
 
+	def _compile(self):
+		'''
+			Builds the routing table from the registered handlers.
+			Events with a topic run the topic's handlers then the type's wildcard handlers,
+			events without one only run the wildcard handlers.
+		'''
+		wildcards = {type: tuple(topics.get(None, ())) for type, topics in self._handlers.items()}
+		routes = dict()
+		for type, topics in self._handlers.items():
+			for topic, handlers in topics.items():
+				if topic is None:
+					routes[(type, None)] = wildcards[type]
+				else:
+					routes[(type, topic)] = tuple(handlers) + wildcards[type]
+		return routes, wildcards
+
+	def shutdown(self, wait = True, timeout = None):
+		if self._executor:
+			return self._executor.shutdown(wait, timeout)
+		return True
 
 	def _register(self, type, topic, handler, oneshot = False):
 		_log.debug('Registering handler for type: %s, topic: %s'%(ETYPES._fields[type], topic))
 		with self.__lock:
-			self._handlers[type][topic].append(handler)
+			self._handlers.setdefault(type, dict()).setdefault(topic, []).append(self._entry(type, topic, handler))
+			self._table = self._compile()	# Readers see either the old or the new table, never a mix
 
 	def register(self, type, topic, handler, oneshot = False):
 		self._register(type, topic, handler, oneshot)
+
+class LoopDispatcher(Dispatcher):
+	'''
+		A Dispatcher that starts coroutine function handlers, and batched handlers whose batch()
+		is a coroutine function, as tasks on the loop. Their events are done once the task ends.
+		Other handlers are called exactly as by the Dispatcher.
+		Events can be dispatched from other threads, such as workers and the executor,
+		their tasks are handed to the loop thread safely
+	'''
+	def __init__(self, loop, threads = 0):
+		self._loop = loop
+		super().__init__(threads)
+
+	def _run(self, entry, event, pending = None):
+		if not asyncio.iscoroutinefunction(entry[0]):
+			return super()._run(entry, event, pending)
+		held = [pending] if pending else []
+		for p in held:
+			p.hold()
+		self._spawn(self._await(entry, event, held))
+		return True
+
+	def _run_batch(self, entry, batch):
+		if not asyncio.iscoroutinefunction(getattr(entry[0], 'batch', None)):
+			return super()._run_batch(entry, batch)
+		held = [p for event, p in batch if p]
+		for p in held:
+			p.hold()
+		self._spawn(self._await(entry, [event for event, p in batch], held, True))
+
+	def _spawn(self, coro):
+		if on_loop(self._loop):
+			self._loop.create_task(coro)
+		else:
+			asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+	async def _await(self, entry, arg, held, batch = False):
+		'''
+			Runs a coroutine handler, its events are done once it returns
+		'''
+		handler, latency, errors = entry
+		start = perf_counter()
+		try:
+			if batch:
+				await handler.batch(arg)
+			else:
+				await handler(arg)
+		except Exception as e:
+			errors.inc()
+			_log.error('Handler %s threw an exception'%handler)
+			_log.exception(e)
+		finally:
+			latency.observe(perf_counter() - start)
+			_release(held)
@@ -1,133 +1,70 @@
-from .dispatch import Event
+from .dispatch import Event, Field
 from .const import EVENT_TYPES as ETYPES
-from .const import CMD_TYPES as CTYPES
-import re
+from . import lexer
 
 class MessageEvent(Event):
+	__slots__ = ()
 	type  = ETYPES.MSG
-	@property
-	def text(self):
-		return self._get('text')
-
-	@property
-	def user(self):
-		return self._get('user')
-
-	@property
-	def channel(self):
-		return self._get('channel')
-
-	@property
-	def public(self):
-		return self._get('public')
+	text = Field('text')
+	user = Field('user')
+	channel = Field('channel')
+	public = Field('public')
 
 class CommandEvent(MessageEvent):
+	__slots__ = ()
 	type = ETYPES.CMD
-	bang_cmd = r'^!(?P<cmd>[a-z]{3,10})(?:[ \t]+(?P<args>[\w ]+))?'
-	at_cmd = r'^<@(?P<user>\w+)>\s(?P<cmd>[a-z]{3,10})(?:[ \t]+(?P<args>[\w ]+))?'
 	def __init__(self, *args, no_parse = False, **kwargs):
 		super().__init__(*args, **kwargs)
 		if not no_parse:
-			type, cmd, args = self._parse(self.text)
-			self._set('cmd_type', type)
-			self._set('cmd', cmd)
-			self._set('args', args)
-	
-	def _parse_args(self, args):
-		if not args is None:
-			return args.split(' ')
-
-	def _parse(self, text):
-		match = re.match(self.bang_cmd, self.text)
-		if match:
-			return 'bang', match['cmd'], self._parse_args(match['args'])
-		match = re.match(self.at_cmd, text)
-		if match:
-			return 'at', match['cmd'], self._parse_args(match['args'])
-		return None, []
+			type, cmd, args = lexer.lex(self.text)
+			self._update(dict(cmd_type = type, cmd = cmd, args = args))
+
+	cmd = Field('cmd')
+	args = Field('args')
+	cmd_type = Field('cmd_type')
 
 	@property
-	def cmd(self):
-		return self._get('cmd')
-	@property
-	def args(self):
-		return self._get('args')
-	
-	@property
-	def cmd_type(self):
-		return self._get('cmd_type')
+	def code(self):
+		'''
+			The command's CMD_TYPES value, None if it is not a known command
+		'''
+		return lexer.lookup(self.cmd)
 
 	@property
 	def valid(self):
-		return self.cmd.upper() in CTYPES._fields
+		return self.cmd in lexer.COMMANDS
 
 class SlackValidationEvent(Event):
+	__slots__ = ()
 	type = ETYPES.USER
-	@property
-	def user(self):
-		return self._get('user')
-
-	@property
-	def validated(self):
-		return self._get('valid', False)
-
-	@property
-	def failed(self):
-		return self._get('failed', False)
-
-	@property
-	def uid(self):
-		return self._get('uid')
+	user = Field('user')
+	validated = Field('valid', False)
+	failed = Field('failed', False)
+	uid = Field('uid')
 
 class SendMessageEvent(MessageEvent):
+	__slots__ = ()
 	type = ETYPES.MSG
 	@property
 	def text(self):
 		if self.template and self.args:
 			return self.template.format(**self.args)
 		return self._get('text', '')
-	
-	@property
-	def template(self):
-		return self._get('template')
-	
-	@property
-	def args(self):
-		return self._get('args')
+
+	template = Field('template')
+	args = Field('args')
 
 class StructuredMessageEvent(MessageEvent):
+	__slots__ = ()
 	type = ETYPES.MSG
-	@property
-	def pretext(self):
-		return self._get('pretext')
-
-	@property
-	def author(self):
-		return self._get('auther')
-	
-	@property
-	def author_link(self):
-		return self._get('author_link')
-
-	@property
-	def title(self):
-		return self._get('title')
-
-	@property
-	def title_link(self):
-		return self._get('title_link')
-
-	@property
-	def color(self):
-		return self._get('color')
-
-	@property
-	def content(self):
-		return self._get('content')
-
-	@property
-	def fields(self):
-		return self._get('fields')
+	pretext = Field('pretext')
+	author = Field('auther')
+	author_link = Field('author_link')
+	title = Field('title')
+	title_link = Field('title_link')
+	color = Field('color')
+	content = Field('content')
+	fields = Field('fields')
 
 	@property
 	def attachments(self):
@@ -153,89 +90,75 @@ class StructuredMessageEvent(MessageEvent):
 		return [msg]
 
 class UpdateUserEvent(MessageEvent):
+	__slots__ = ()
 	type = ETYPES.USER
-	@property
-	def key(self):
-		return self._get('key')
-	
-	@property
-	def value(self):
-		return self._get('value')
+	key = Field('key')
+	value = Field('value')
 
 class UserUpdatedEvent(MessageEvent):
+	__slots__ = ()
 	type = ETYPES.USER
 
 class CollectInfoEvent(MessageEvent):
+	__slots__ = ()
 	type = ETYPES.USER
 
 class UserRegisteredEvent(MessageEvent):
+	__slots__ = ()
 	type = ETYPES.USER
 
 class GameEvent(Event):
+	__slots__ = ()
 	type = ETYPES.GAME
-	@property
-	def users(self):
-		return self._get('users', [])
-
-	@property
-	def game(self):
-		return self._get('game')
+	users = Field('users', ())
+	game = Field('game')
 
 class StartGameEvent(GameEvent):
-	pass
+	__slots__ = ()
 
 class SetupGameEvent(GameEvent):
-	pass
+	__slots__ = ()
 
 class LockUsersEvent(GameEvent):
-	pass
+	__slots__ = ()
 
 class AssignInitialHitsEvent(GameEvent):
-	pass
+	__slots__ = ()
 
 class CheckFreeEvent(Event):
+	__slots__ = ()
+	type = ETYPES.CRON
+
+class SyncDirectoryEvent(Event):
+	__slots__ = ()
 	type = ETYPES.CRON
 
 class AssignmentNotifyEvent(Event):
+	__slots__ = ()
 	type = ETYPES.MSG
-	@property
-	def game(self):
-		return self._get('game')
-
-	@property
-	def user(self):
-		return self._get('user')
+	game = Field('game')
+	user = Field('user')
 
 class AssignNextRoundEvent(GameEvent):
-	pass
+	__slots__ = ()
 
 class CheckForWinnerEvent(GameEvent):
-	pass
+	__slots__ = ()
 
 class KillConfirmedEvent(Event):
+	__slots__ = ()
 	type = ETYPES.GAME
-	@property
-	def game(self):
-		return self._get('game')
-
-	@property
-	def user(self):
-		return self._get('user')
+	game = Field('game')
+	user = Field('user')
 
 class ConfirmKillEvent(KillConfirmedEvent):
-	pass
+	__slots__ = ()
 
 class ConfirmKillMessageEvent(MessageEvent):
-	pass
+	__slots__ = ()
 
 class EndGameEvent(Event):
+	__slots__ = ()
 	type = ETYPES.GAME
-	@property
-	def game(self):
-		return self._get('game')
-
-	@property
-	def winner(self):
-		return self._get('winner')
-
-
+	game = Field('game')
+	winner = Field('winner')
@@ -0,0 +1,185 @@
+import os
+import time
+from threading import Lock
+from collections import OrderedDict
+from . import codec
+from ..util.log import getLogger
+
+_log = getLogger('bot.journal')
+
+'''
+	This module implements an append-only journal of agent events.
+	Every event is recorded when it is queued and marked done once it has been dispatched,
+	so events still queued or in flight when the agent dies can be replayed on startup.
+
+	The journal is a directory of numbered segment files, each a sequence of lines:
+		P <id> <encoded event>		an event was queued
+		D <id>						the event has been dispatched
+		M <id>						the unfinished event was recorded again under a new id at startup
+	A new segment is started once the current one grows past `segment_size`,
+	and old segments are deleted when every event recorded in them is done,
+	unless `keep` is set to retain the traffic for replay.
+'''
+
+_PUT = b'P'
+_DONE = b'D'
+_MOVED = b'M'
+_SUFFIX = '.journal'
+
+def _segment_name(number):
+	return '%010d%s'%(number, _SUFFIX)
+
+def segments(path):
+	return sorted(f for f in os.listdir(path) if f.endswith(_SUFFIX))
+
+def read(path):
+	'''
+		Yields (id, event, done) for every event recorded in the journal at `path`, in order
+	'''
+	records = OrderedDict()
+	for name in segments(path):
+		with open(os.path.join(path, name), 'rb') as segment:
+			for line in segment:
+				op, _, rest = line.rstrip(b'\n').partition(b' ')
+				if op == _PUT:
+					jid, _, blob = rest.partition(b' ')
+					try:
+						records[int(jid)] = [codec.decode(blob), False]
+					except Exception:	# A torn write at the tail of the last segment
+						_log.warning('Skipping unreadable journal entry in %s'%name)
+				elif op in (_DONE, _MOVED):
+					try:
+						jid = int(rest)
+					except ValueError:	# A torn write at the tail of the last segment
+						_log.warning('Skipping unreadable journal entry in %s'%name)
+						continue
+					if op == _MOVED:
+						records.pop(jid, None)
+					elif jid in records:
+						records[jid][1] = True
+	for jid, (event, done) in records.items():
+		yield jid, event, done
+
+class Journal:
+	def __init__(self, path, segment_size = 4 * 2**20, fsync = False, keep = False):
+		self._path = path
+		self._segment_size = int(segment_size)
+		self._fsync = fsync
+		self._keep = keep
+		self._lock = Lock()
+		self._segments = OrderedDict()	# segment number -> ids recorded in it that are not done
+		self._owner = dict()
+		self._file = None
+		self._current = 0
+		self._next_id = 0
+
+	def open(self):
+		'''
+			Opens the journal for writing, returning the events that were never marked done.
+			These are recorded again, and should be queued without calling record()
+		'''
+		os.makedirs(self._path, exist_ok = True)
+		pending = []
+		numbers = [int(name[:-len(_SUFFIX)]) for name in segments(self._path)]
+		for jid, event, done in read(self._path):
+			self._next_id = max(self._next_id, jid + 1)
+			if not done:
+				pending.append((jid, event))
+		self._current = max(numbers) if numbers else 0
+		self._roll()
+		for jid, event in pending:	# Unfinished events are carried over to the new segment before the old ones go
+			self.record(event)
+			self._write(b'M %d\n'%jid)
+		if not self._keep:
+			for number in numbers:
+				os.remove(os.path.join(self._path, _segment_name(number)))
+		_log.info('Opened journal %s, %s events left unfinished'%(self._path, len(pending)))
+		return [event for jid, event in pending]
+
+	def _roll(self):
+		if self._file:
+			self._file.close()
+		self._current += 1
+		self._segments[self._current] = set()
+		self._file = open(os.path.join(self._path, _segment_name(self._current)), 'ab')
+		self._collect()
+
+	def _collect(self):
+		if self._keep:
+			return
+		for number, outstanding in list(self._segments.items()):
+			if outstanding or number == self._current:
+				continue
+			del self._segments[number]
+			try:
+				os.remove(os.path.join(self._path, _segment_name(number)))
+			except OSError:
+				pass
+
+	def _write(self, line):
+		self._file.write(line)
+		self._file.flush()
+		if self._fsync:
+			os.fsync(self._file.fileno())
+		if self._file.tell() >= self._segment_size:
+			self._roll()
+
+	def record(self, event):
+		try:
+			blob = codec.encode(event)
+		except codec.UnknownEvent:
+			_log.warning('Not journaling unregistered event %s'%event.__class__.__name__)
+			return None
+		with self._lock:
+			if self._file is None:
+				_log.warning('Journal is closed, not journaling %s'%event.__class__.__name__)
+				return None
+			jid = self._next_id
+			self._next_id += 1
+			self._segments[self._current].add(jid)
+			self._owner[jid] = self._current
+			self._write(b'P %d '%jid + blob + b'\n')
+		event._journal_id = jid
+		return jid
+
+	def done(self, event):
+		jid = getattr(event, '_journal_id', None)
+		if jid is None:
+			return
+		with self._lock:
+			if self._file is None:	# Left pending, the event is replayed on the next start
+				_log.warning('Journal is closed, event %s will be replayed'%jid)
+				return
+			number = self._owner.pop(jid, None)
+			if number is None:
+				return
+			self._segments[number].discard(jid)
+			self._write(b'D %d\n'%jid)
+			if not self._segments[number] and number != self._current:
+				self._collect()
+		event._journal_id = None
+
+	def close(self):
+		with self._lock:
+			if self._file:
+				self._file.close()
+				self._file = None
+
+def replay(path, dispatch, pending = None, unfinished = False):
+	'''
+		Runs every event recorded in the journal at `path` through `dispatch` as fast as possible.
+		Events the handlers push are collected in `pending`, a deque, and dispatched too.
+		With `unfinished` set only events that were never marked done are replayed.
+		Returns the number of events dispatched and the time it took
+	'''
+	count = 0
+	start = time.perf_counter()
+	for jid, event, done in read(path):
+		if unfinished and done:
+			continue
+		dispatch(event)
+		count += 1
+		while pending:
+			dispatch(pending.popleft())
+			count += 1
+	return count, time.perf_counter() - start
@@ -0,0 +1,225 @@
+from threading import Condition, get_ident
+from queue import Empty
+from collections import deque
+from time import monotonic
+from .const import EVENT_TYPES as ETYPES
+from .dispatch import partition_key
+from ..util.log import getLogger
+
+_log = getLogger('bot.lanes')
+
+'''
+	This module implements the agent's event queue.
+	Events are sorted into lanes, by topic first and then by event type,
+	and lanes are drained in weighted round robin.
+	A lane with weight 4 is served up to 4 events in a row before the next lane gets a turn,
+	so game state transitions stay responsive during message storms
+	without starving the lower priority lanes.
+
+	Lanes can be bounded with `size`, what happens to an event put onto a full lane
+	is decided by the policy matching the event:
+		-	block		the producer waits for room
+		-	drop_oldest	the oldest event in the lane is dropped to make room
+		-	drop_newest	the incoming event is shed
+		-	coalesce	the event replaces a queued event with the same topic and user/game,
+						this happens even when the lane is not full.
+						If there is nothing to replace in a full lane, the oldest event is dropped
+	Threads consuming from the queue never block on put, as they would wait on themselves.
+	Events dropped or replaced after they were queued are passed to `on_evict`,
+	put() returns False for a shed event instead.
+'''
+
+POLICIES = ('block', 'drop_oldest', 'drop_newest', 'coalesce')
+
+def parse_policies(policies):
+	'''
+		Converts a list of dict(match = `TYPE` or `TYPE:topic`, policy = name)
+		into a mapping keyed on type or (type, topic), `TYPE:None` matches events without a topic
+	'''
+	parsed = {}
+	for entry in policies:
+		key, policy = entry['match'], entry['policy']
+		if not policy in POLICIES:
+			raise ValueError('Unknown queue policy %s for %s'%(policy, key))
+		type, _, topic = key.partition(':')
+		type = getattr(ETYPES, type)
+		if _:
+			parsed[(type, None if topic == 'None' else topic)] = policy
+		else:
+			parsed[type] = policy
+	return parsed
+
+class Lane:
+	def __init__(self, name, weight = 1, size = 0, types = [], topics = []):
+		self.name = name
+		self.weight = max(int(weight), 1)
+		self.size = int(size)
+		self.types = [getattr(ETYPES, t) for t in types]
+		self.topics = list(topics)
+		self.credit = self.weight
+		self.events = deque()
+		self.coalescing = dict()
+		self.enqueued = 0
+		self.dequeued = 0
+		self.dropped = 0
+		self.shed = 0
+		self.coalesced = 0
+		self.blocked = 0
+
+	def __len__(self):
+		return len(self.events)
+
+	@property
+	def full(self):
+		return self.size and len(self.events) >= self.size
+
+	def append(self, event, key = None):
+		if key is None:
+			self.events.append(event)
+		else:
+			slot = [event, key]	# Coalescable events are queued in a slot so they can be replaced in place
+			self.coalescing[key] = slot
+			self.events.append(slot)
+
+	def popleft(self):
+		event = self.events.popleft()
+		if isinstance(event, list):
+			self.coalescing.pop(event[1], None)
+			event = event[0]
+		return event
+
+	@property
+	def stats(self):
+		return dict(depth = len(self.events), weight = self.weight, size = self.size,
+					enqueued = self.enqueued, dequeued = self.dequeued,
+					dropped = self.dropped, shed = self.shed,
+					coalesced = self.coalesced, blocked = self.blocked)
+
+class LaneQueue:
+	def __init__(self, lanes, policies = [], default_policy = 'block', on_evict = None):
+		self._lanes = [Lane(**lane) for lane in lanes]
+		self._on_evict = on_evict
+		if not self._lanes:
+			self._lanes = [Lane('default')]
+		self._by_topic = {}
+		self._by_type = {}
+		for lane in reversed(self._lanes):	# Earlier lanes win when a type or topic is listed twice
+			self._by_topic.update({t: lane for t in lane.topics})
+			self._by_type.update({t: lane for t in lane.types})
+		self._default = self._lanes[-1]
+		self._policies = parse_policies(policies)
+		self._default_policy = default_policy
+		self._consumers = set()
+		self._current = 0
+		self._size = 0
+		self._cond = Condition()
+
+	def _lane(self, event):
+		lane = self._by_topic.get(event.topic)
+		if lane is None:
+			lane = self._by_type.get(event.type, self._default)
+		return lane
+
+	def _policy(self, event):
+		policy = self._policies.get((event.type, event.topic))
+		if policy is None:
+			policy = self._policies.get(event.type, self._default_policy)
+		return policy
+
+	def qsize(self):
+		return self._size
+
+	def empty(self):
+		return self._size == 0
+
+	def put(self, event):
+		evicted = None
+		try:
+			with self._cond:
+				accepted, evicted = self._put(event)
+				return accepted
+		finally:
+			if evicted is not None and self._on_evict:
+				self._on_evict(evicted)
+
+	def _put(self, event):
+		'''
+			Queues an event, returns whether it was accepted and the event it evicted, if any
+		'''
+		lane = self._lane(event)
+		policy = self._policy(event)
+		evicted = None
+		key = None
+		if policy == 'coalesce':
+			key = (event.topic, partition_key(event))
+			slot = lane.coalescing.get(key)
+			if slot:
+				evicted, slot[0] = slot[0], event
+				lane.coalesced += 1
+				return True, evicted
+		if lane.full:
+			if policy == 'block' and not get_ident() in self._consumers:
+				lane.blocked += 1
+				while lane.full:
+					self._cond.wait()
+			elif policy == 'drop_newest':
+				lane.shed += 1
+				return False, None
+			elif policy in ('drop_oldest', 'coalesce'):
+				evicted = lane.popleft()
+				lane.dropped += 1
+				self._size -= 1
+		lane.append(event, key)
+		lane.enqueued += 1
+		self._size += 1
+		self._cond.notify_all()
+		return True, evicted
+
+	def _pop(self):
+		count = len(self._lanes)
+		for x in range(count * 2):
+			lane = self._lanes[self._current]
+			if lane.events and lane.credit > 0:
+				lane.credit -= 1
+				lane.dequeued += 1
+				self._size -= 1
+				return lane.popleft()
+			lane.credit = lane.weight
+			self._current = (self._current + 1) % count
+		return None
+
+	def get(self, block = True, timeout = None):
+		with self._cond:
+			self._consumers.add(get_ident())
+			if block:
+				deadline = monotonic() + timeout if timeout is not None else None
+				while not self._size:
+					remaining = deadline - monotonic() if deadline is not None else None
+					if remaining is not None and remaining <= 0:
+						raise Empty
+					self._cond.wait(remaining)
+			elif not self._size:
+				raise Empty
+			event = self._pop()
+			self._cond.notify_all()	# Wake producers blocked on a full lane
+			return event
+
+	def get_batch(self, count, block = True, timeout = None):
+		'''
+			Waits for at least one event like get(),
+			then drains up to `count` events under a single lock acquisition
+		'''
+		with self._cond:
+			batch = [self.get(block, timeout)]	# Condition wraps an RLock, so this can re-enter
+			while self._size and len(batch) < count:
+				batch.append(self._pop())
+			self._cond.notify_all()
+			return batch
+
+	@property
+	def depths(self):
+		return {lane.name: len(lane) for lane in self._lanes}
+
+	@property
+	def stats(self):
+		return {lane.name: lane.stats for lane in self._lanes}
@@ -0,0 +1,61 @@
+import re
+from string import ascii_lowercase
+from .const import CMD_TYPES as CTYPES
+
+'''
+	This module implements the command lexer for CommandEvent.
+	A command is the first line of a message, either
+		!cmd [args]
+		<@USER> cmd [args]
+	where cmd is 3 to 10 lower case letters.
+	Arguments are split on whitespace, text in double, single or slack's curly quotes
+	is kept as a single argument, an unterminated quote is part of a plain word.
+	The line is taken apart with str.split instead of regexes,
+	only arguments containing quotes go through a precompiled tokenizer.
+'''
+
+# Command name -> CMD_TYPES value
+COMMANDS = {name.lower(): value for name, value in CTYPES._asdict().items()}
+
+_NONE = (None, None, None)
+_LETTERS = frozenset(ascii_lowercase)
+_QUOTED = re.compile('"([^"]*)"|\'([^\']*)\'|“([^”]*)”|(\\S+)')
+
+def _args(rest):
+	if not ('"' in rest or "'" in rest or '“' in rest):
+		return rest.split() or None
+	return [m.group(m.lastindex) for m in _QUOTED.finditer(rest)] or None
+
+def lex(text):
+	'''
+		Returns (kind, cmd, args) for a command, kind being 'bang' or 'at',
+		or (None, None, None) when the text is not a command
+	'''
+	if not text:
+		return _NONE
+	if '\n' in text:
+		text = text[:text.index('\n')]
+	first = text[:1]
+	if first == '!':
+		parts = text.split(None, 1)
+		kind, cmd = 'bang', parts[0][1:]
+	elif first == '<':
+		parts = text.split(None, 2)
+		mention = parts[0]
+		if len(parts) < 2 or mention[:2] != '<@' or mention[-1:] != '>' or not mention[2:-1].replace('_', 'a').isalnum():
+			return _NONE
+		kind, cmd = 'at', parts[1]
+		del parts[0]
+	else:
+		return _NONE
+	if not (3 <= len(cmd) <= 10 and _LETTERS.issuperset(cmd)):
+		return _NONE
+	if len(parts) < 2:
+		return kind, cmd, None
+	return kind, cmd, _args(parts[1])
+
+def lookup(cmd):
+	'''
+		Returns the CMD_TYPES value of a command, or None if it is unknown
+	'''
+	return COMMANDS.get(cmd)
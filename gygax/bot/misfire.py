@@ -0,0 +1,67 @@
+import re
+from fnmatch import translate
+from datetime import timedelta
+from ..util.time import convert_delta, is_walltime
+from ..util.log import getLogger
+
+_log = getLogger('bot.misfire')
+
+'''
+	This module decides what happens to scheduled events
+	that came due while the agent was not running.
+	Policies are matched on the schedule key with shell style patterns:
+		-	once	fire the event a single time, however many runs were missed
+		-	all		fire the event once for every missed run, up to `limit`
+		-	skip	drop the missed runs
+	Repeating events are re-armed at their next run after now, keeping their original phase.
+'''
+
+POLICIES = ('once', 'all', 'skip')
+DAY = timedelta(days = 1)
+
+def period(delay):
+	'''
+		Returns the interval a repeating event runs at,
+		wall times like 23:42 repeat daily
+	'''
+	if is_walltime(delay):
+		return DAY
+	return convert_delta(delay)
+
+class MisfirePolicy:
+	def __init__(self, rules = [], default = 'once', limit = 100):
+		self._rules = []
+		for rule in rules:
+			if not rule['policy'] in POLICIES:
+				raise ValueError('Unknown misfire policy %s for %s'%(rule['policy'], rule['match']))
+			self._rules.append((re.compile(translate(rule['match'])).match, rule['policy']))
+		if not default in POLICIES:
+			raise ValueError('Unknown misfire policy %s'%default)
+		self._default = default
+		self._limit = int(limit)
+
+	def __call__(self, key):
+		for match, policy in self._rules:
+			if match(key):
+				return policy
+		return self._default
+
+	def plan(self, key, time, delay, repeat, now):
+		'''
+			Returns how many times to fire an event due at `time`,
+			and when it should next run, or None if it should be dropped
+		'''
+		if time > now:
+			return 0, time
+		missed = 1
+		due = None
+		if repeat:
+			interval = period(delay)
+			missed = (now - time) // interval + 1
+			due = time + interval * missed
+		policy = self(key)
+		if policy == 'once':
+			return 1, due
+		elif policy == 'all':
+			return min(missed, self._limit), due
+		return 0, due
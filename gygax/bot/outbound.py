@@ -0,0 +1,273 @@
+from threading import Lock
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import time
+from ..util.scheduler import Scheduler
+from ..util.ratelimit import TokenBucket, RateLimited
+from ..util.client import retryable
+from ..util.log import getLogger
+from ..util.metrics import metrics
+
+_log = getLogger('bot.outbound')
+
+'''
+	This module implements the outbound message stage.
+	Messages are buffered per recipient for a short window, opened by the first message,
+	then sent as a single post, merging several messages into one post with one attachment each.
+	A game transition that messages the same user a few times in a row
+	then costs one chat.postMessage instead of one per message.
+
+	A window of 0 queues every message as a post of its own.
+
+	Posts are queued per recipient and delivered one at a time and in order, on a thread pool.
+	Each post takes a token from the bucket shared by every post, sized to the post method's rate limit,
+	and one from its recipient's bucket, a post without tokens waits on a timer without holding a thread.
+	When slack answers with a 429 the shared bucket is paused for its Retry-After
+	and the post is retried after it. Posts refused with a 5xx, or never sent for a failed connection,
+	are retried with exponential backoff. Any other error is final, the post may already have
+	reached slack and sending it again would post it twice.
+	A post waiting for a retry, or still queued at shutdown, is stored through `save`
+	and delivered by restore() on the next start.
+'''
+
+def text_attachment(text):
+	return dict(text = text, fallback = text, mrkdwn_in = ['text'])
+
+def merge(messages, limit = 20):
+	'''
+		Merges buffered (text, attachments) messages into as few posts as possible,
+		each with at most `limit` attachments. A single message is posted unchanged
+	'''
+	if len(messages) == 1:
+		return messages
+	attachments = []
+	for text, attach in messages:
+		if text:
+			attachments.append(text_attachment(text))
+		if attach:
+			attachments.extend(attach)
+	return [(None, attachments[x:x + limit]) for x in range(0, len(attachments), limit)]
+
+class Post:
+	__slots__ = ('recipient', 'text', 'attachments', 'queued', 'attempts', 'reserved', 'stored')
+	def __init__(self, recipient, text, attachments, stored = None):
+		self.recipient = recipient
+		self.text = text
+		self.attachments = attachments
+		self.queued = time.monotonic()
+		self.attempts = 0
+		self.reserved = False	# Its tokens are taken, it is sent without taking more
+		self.stored = stored	# The id it was saved with
+
+class Outbound:
+	'''
+		`rate` and `channel_rate` are posts per second, None leaves them unlimited.
+		`save(recipient, text, attachments)` stores a post and returns an id, `remove(id)` deletes it
+	'''
+	def __init__(self, post, window = 0, limit = 20, threads = 4,
+					rate = None, burst = 1, channel_rate = None, channel_burst = 1, retries = 5,
+					save = None, remove = None):
+		self._post = post
+		self._window = window / 1000.0
+		self._limit = limit
+		self._threads = threads
+		self._bucket = TokenBucket(rate, burst) if rate else None
+		self._channel_rate = channel_rate
+		self._channel_burst = channel_burst
+		self._channels = dict()
+		self._retries = retries
+		self._save = save
+		self._remove = remove
+		self._pending = dict()
+		self._queues = dict()
+		self._busy = set()
+		self._lock = Lock()
+		self._timers = None
+		self._pool = None
+		self._posts = metrics.counter('outbound_posts')
+		self._messages = metrics.counter('outbound_messages')
+		self._throttled = metrics.counter('outbound_throttled')
+		self._failed = metrics.counter('outbound_failed')
+		self._delivery = metrics.histogram('outbound_delivery')
+
+	def _start(self):
+		self._timers = Scheduler('outbound')
+		self._timers.start()
+		self._pool = ThreadPoolExecutor(max_workers = self._threads)
+
+	def send(self, recipient, text = None, attachments = None):
+		'''
+			Queues a message for `recipient`, a hashable the post function understands
+		'''
+		with self._lock:
+			if self._timers is None:
+				self._start()
+			self._messages.inc()
+			if not self._window:
+				self._queue(recipient, [(text, attachments)])
+				return True
+			buffered = self._pending.get(recipient)
+			if buffered is not None:
+				buffered.append((text, attachments))
+				return True
+			self._pending[recipient] = [(text, attachments)]
+			self._timers.schedule(('flush', recipient), self._window, self._flush, recipient)
+		return True
+
+	def restore(self, posts):
+		'''
+			Queues stored (id, recipient, text, attachments) posts for delivery
+		'''
+		if not posts:
+			return
+		with self._lock:
+			if self._timers is None:
+				self._start()
+			for stored, recipient, text, attachments in posts:
+				self._queues.setdefault(recipient, deque()).append(Post(recipient, text, attachments, stored))
+				self._kick(recipient)
+
+	def _flush(self, recipient):
+		with self._lock:
+			messages = self._pending.pop(recipient, None)
+			if messages:
+				self._queue(recipient, messages)
+
+	def _queue(self, recipient, messages):
+		posts = merge(messages, self._limit)
+		_log.debug('Queueing %s messages to %s as %s posts'%(len(messages), recipient, len(posts)))
+		queue = self._queues.setdefault(recipient, deque())
+		for text, attachments in posts:
+			queue.append(Post(recipient, text, attachments))
+		self._kick(recipient)
+
+	def _kick(self, recipient):
+		if not recipient in self._busy:
+			self._busy.add(recipient)
+			self._pool.submit(self._deliver, recipient)
+
+	def _resume(self, recipient):
+		self._pool.submit(self._deliver, recipient)
+
+	def _wait(self, post):
+		'''
+			Takes the post's tokens, returns the seconds it has to wait before it is sent
+		'''
+		if post.reserved:
+			return 0.0
+		post.reserved = True
+		wait = self._bucket.reserve() if self._bucket else 0.0
+		if self._channel_rate:
+			bucket = self._channels.get(post.recipient)
+			if bucket is None:
+				bucket = self._channels[post.recipient] = TokenBucket(self._channel_rate, self._channel_burst)
+			wait = max(wait, bucket.reserve())
+		return wait
+
+	def _deliver(self, recipient):
+		'''
+			Sends the recipient's queued posts in order, only one _deliver runs per recipient
+		'''
+		queue = self._queues[recipient]
+		while True:
+			with self._lock:
+				if not queue:
+					del self._queues[recipient]
+					self._busy.discard(recipient)
+					bucket = self._channels.get(recipient)
+					if bucket is not None and bucket.idle:
+						del self._channels[recipient]
+					return
+				post = queue[0]
+			wait = self._wait(post)
+			if wait > 0:
+				self._throttled.inc()
+				self._timers.schedule(('deliver', recipient), wait, self._resume, recipient)
+				return
+			if not self._attempt(post):
+				return
+			with self._lock:
+				queue.popleft()
+
+	def _attempt(self, post):
+		'''
+			Sends a post, returns False when it was scheduled to be retried
+		'''
+		self._posts.inc()
+		try:
+			ok = self._post(post.recipient, post.text, post.attachments)
+		except RateLimited as e:
+			_log.warning('Rate limited sending to %s, retrying in %ss'%(post.recipient, e.retry_after))
+			metrics.counter('outbound_retries', 'rate_limited').inc()
+			if self._bucket:
+				self._bucket.pause(e.retry_after)
+			return self._retry(post, e.retry_after)
+		except Exception as e:
+			post.attempts += 1
+			_log.error('Failed to send message to %s'%(post.recipient,))
+			_log.exception(e)
+			if retryable(e) and post.attempts <= self._retries:
+				metrics.counter('outbound_retries', 'error').inc()
+				return self._retry(post, min(2 ** post.attempts, 60))
+			if retryable(e):
+				_log.error('Dropping message to %s after %s attempts'%(post.recipient, post.attempts))
+			ok = False
+		if ok:
+			self._delivery.observe(time.monotonic() - post.queued)
+		else:
+			_log.error('Failed to send message to %s'%(post.recipient,))
+			self._failed.inc()
+		if post.stored is not None:
+			self._unstore(post)
+		return True
+
+	def _retry(self, post, delay):
+		post.reserved = False
+		self._store(post)
+		self._timers.schedule(('deliver', post.recipient), delay, self._resume, post.recipient)
+		return False
+
+	def _store(self, post):
+		if self._save is None or post.stored is not None:
+			return
+		try:
+			post.stored = self._save(post.recipient, post.text, post.attachments)
+		except Exception as e:
+			_log.error('Failed to store message to %s'%(post.recipient,))
+			_log.exception(e)
+
+	def _unstore(self, post):
+		try:
+			self._remove(post.stored)
+		except Exception as e:
+			_log.error('Failed to remove stored message %s'%post.stored)
+			_log.exception(e)
+
+	@property
+	def pending(self):
+		with self._lock:
+			return sum(len(m) for m in self._pending.values()) + sum(len(q) for q in self._queues.values())
+
+	def join(self, timeout = None):
+		'''
+			Sends everything still buffered and waits for it,
+			posts not delivered within `timeout` are stored for the next start
+		'''
+		if self._timers is None:
+			return
+		deadline = None if timeout is None else time.monotonic() + timeout
+		with self._lock:
+			pending, self._pending = self._pending, dict()
+			for recipient, messages in pending.items():
+				self._timers.cancel(('flush', recipient))
+				self._queue(recipient, messages)
+		while self._busy and (deadline is None or time.monotonic() < deadline):
+			time.sleep(0.05)
+		self._timers.join(1)
+		self._pool.shutdown(wait = True)
+		with self._lock:
+			left = [post for queue in self._queues.values() for post in queue]
+		for post in left:
+			self._store(post)
+		if left:
+			_log.warning('%s posts were not delivered before shutdown'%len(left))
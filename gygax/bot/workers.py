@@ -0,0 +1,76 @@
+from threading import Thread
+from queue import Queue
+from zlib import crc32
+from .dispatch import partition_key
+from ..util.log import getLogger
+
+_log = getLogger('bot.workers')
+
+'''
+	This module implements a keyed worker pool.
+	Events are partitioned across a fixed set of worker threads by a key,
+	the user an event concerns, or the game uuid for game events.
+	All events sharing a key land on the same worker and are handled in order,
+	while events for unrelated users are handled concurrently.
+'''
+
+class Worker(Thread):
+	def __init__(self, handler, name):
+		self._handler = handler
+		self._queue = Queue()
+		super().__init__(name = name)
+		self.daemon = True
+
+	def put(self, event):
+		self._queue.put(event)
+
+	def stop(self):
+		self._queue.put(None)
+
+	@property
+	def depth(self):
+		return self._queue.qsize()
+
+	def run(self):
+		while True:
+			event = self._queue.get()
+			if event is None:
+				break
+			try:
+				self._handler(event)
+			except Exception as e:
+				_log.error('Worker %s failed handling event %s'%(self.name, event))
+				_log.exception(e)
+
+class WorkerPool:
+	def __init__(self, handler, size, key = partition_key):
+		self._key = key
+		self._workers = [Worker(handler, 'worker-%s'%x) for x in range(size)]
+
+	def __len__(self):
+		return len(self._workers)
+
+	def _route(self, event):
+		key = self._key(event)
+		if key is None:
+			return self._workers[0]
+		return self._workers[crc32(str(key).encode()) % len(self._workers)]
+
+	def submit(self, event):
+		self._route(event).put(event)
+
+	@property
+	def depths(self):
+		return [w.depth for w in self._workers]
+
+	def start(self):
+		_log.debug('Starting %s workers'%len(self._workers))
+		for worker in self._workers:
+			worker.start()
+
+	def join(self, timeout = None):
+		for worker in self._workers:
+			worker.stop()
+		for worker in self._workers:
+			if worker.is_alive():
+				worker.join(timeout)
@@ -4,11 +4,10 @@ from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 from collections import namedtuple
 from .app import Session
-from .api.slack import Slack as SlackApi
 from .util.crypto import rand_key
 from .bot.const import HIT_STATUS as HSTAT
 from .bot.const import USER_STATUS as USTAT
-import pickle
+from .bot import codec
 
 Base = declarative_base()
 
@@ -25,14 +24,14 @@ class Slack(Base, Query):
 	__tablename__ = 'slack'
 	id = Column(Integer, primary_key = True)
 	name = Column(String(32))
+	real_name = Column(String(128))
+	tz = Column(String(64))
 	slack_id = Column(String(64), unique = True)
 	confirmed = Column(Boolean, default = False)
 	updated  = Column(DateTime(), default=datetime.utcnow)
 
 	def __init__(self, slack):
-		self.slack_id = slack
-		info = SlackApi._get_user_info(slack)
-		self.name = info['name'] if info else None
+		self.slack_id = slack	# The profile is filled in later by api.enricher
 
 	snapshot_type = namedtuple('Slack', ['slack_id','name','confirmed','updated'])
 	@property
@@ -152,6 +151,36 @@ class Game(Base, Query):
 	def remaining_players(self):
 		return [p for p in self.players if p.status != USTAT.DEAD]
 
+class DirectMessage(Base):
+	__tablename__ = 'dm_channel'
+	id = Column(Integer, primary_key = True)
+	slack_id = Column(String(64), unique = True)
+	channel = Column(String(64), unique = True)
+	updated = Column(DateTime(), default=datetime.utcnow, onupdate=datetime.utcnow)
+
+	def __init__(self, slack_id, channel):
+		self.slack_id = slack_id
+		self.channel = channel
+
+class DirectoryEntry(Base):
+	__tablename__ = 'slack_directory'
+	id = Column(Integer, primary_key = True)
+	slack_id = Column(String(64), unique = True)
+	name = Column(String(128), index = True)
+	real_name = Column(String(128))
+	tz = Column(String(64))
+	deleted = Column(Boolean, default = False)
+	updated = Column(Integer, default = 0)	# Slack's profile update time, seconds since the epoch
+
+class OutboundPost(Base):
+	__tablename__ = 'outbound'
+	id = Column(Integer, primary_key = True)
+	kind = Column(String(16))
+	target = Column(String(64))
+	text = Column(Text)
+	attachments = Column(Text)
+	created = Column(DateTime(), default=datetime.utcnow)
+
 class Schedule(Base):
 	__tablename__ = 'schedule'
 	id = Column(Integer, primary_key = True)
@@ -168,10 +197,22 @@ class Schedule(Base):
 		self.repeat = repeat
 		self.time = time
 
+	@staticmethod
+	def row(event, delay, uuid, repeat, time):
+		return dict(data = Schedule.encode(event), delay = delay, uuid = uuid, repeat = repeat, time = time)
+
+	@staticmethod
+	def encode(event):
+		return codec.encode(event)
+
+	@staticmethod
+	def decode(data):
+		return codec.decode(data)
+
 	@property
 	def event(self):
-		return pickle.loads(self.data) if self.data else None
+		return Schedule.decode(self.data)
 
 	@event.setter
 	def event(self, event):
-		self.data = pickle.dumps(event)
\ No newline at end of file
+		self.data = Schedule.encode(event)
\ No newline at end of file
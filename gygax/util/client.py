@@ -0,0 +1,139 @@
+import random
+import time
+from threading import Lock
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from .log import getLogger
+from .metrics import metrics
+
+_log = getLogger('util.client')
+
+'''
+	This module implements the http client shared by the slack and auth apis.
+	Each host gets its own requests.Session, so connections are kept alive
+	and reused instead of paying a tcp and tls handshake per call.
+	Every request has a connect and a read timeout.
+
+	Failed calls are retried with full jitter backoff, a random wait of up to
+	backoff * 2 ** attempt, when it is safe to do so.
+	Calls marked idempotent are retried on connection errors, timeouts and 5xx responses.
+	Other calls are only retried when the connection could not be made, as the request was never sent.
+
+	Latency is recorded per endpoint in http_latency,
+	failed calls in http_errors and retries in http_retries.
+'''
+
+RETRY_STATUS = frozenset((500, 502, 503, 504))
+
+class Client:
+	'''
+		Timeouts and `backoff` are in milliseconds, `pool` is the number of connections kept per host
+	'''
+	def __init__(self, name, connect = 3000, read = 10000, retries = 2, backoff = 200, pool = 8):
+		self._name = name
+		self._timeout = (connect / 1000.0, read / 1000.0)
+		self._retries = retries
+		self._backoff = backoff / 1000.0
+		self._pool = pool
+		self._sessions = dict()
+		self._lock = Lock()
+
+	@classmethod
+	def from_config(cls, name, conf):
+		return cls(name,
+					connect = int(conf.connect),
+					read = int(conf.read),
+					retries = int(conf.retries),
+					backoff = int(conf.backoff),
+					pool = int(conf.pool))
+
+	def _session(self, host):
+		session = self._sessions.get(host)
+		if session is None:
+			with self._lock:
+				session = self._sessions.get(host)
+				if session is None:
+					session = requests.Session()
+					adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = self._pool)
+					session.mount('http://', adapter)
+					session.mount('https://', adapter)
+					self._sessions[host] = session
+		return session
+
+	def _wait(self, attempt):
+		time.sleep(random.uniform(0, self._backoff * 2 ** attempt))
+
+	def request(self, method, url, endpoint = None, idempotent = False, **kwargs):
+		'''
+			Sends a request and returns the response.
+			`endpoint` labels the call's stats, the url path by default.
+			Raises requests.RequestException once the retries are used up
+		'''
+		parts = urlsplit(url)
+		endpoint = '%s%s'%(self._name, endpoint or parts.path)
+		session = self._session(parts.netloc)
+		kwargs.setdefault('timeout', self._timeout)
+		latency = metrics.histogram('http_latency', endpoint)
+		attempt = 0
+		while True:
+			start = time.perf_counter()
+			try:
+				resp = session.request(method, url, **kwargs)
+			except requests.ConnectionError as e:
+				latency.observe(time.perf_counter() - start)
+				sent = not unsent(e)
+				error = e
+			except requests.Timeout as e:
+				latency.observe(time.perf_counter() - start)
+				sent, error = True, e
+			else:
+				latency.observe(time.perf_counter() - start)
+				if not (idempotent and resp.status_code in RETRY_STATUS and attempt < self._retries):
+					if resp.status_code >= 500:
+						metrics.counter('http_errors', endpoint).inc()
+					return resp
+				sent, error = True, None
+			if attempt >= self._retries or (sent and not idempotent):
+				metrics.counter('http_errors', endpoint).inc()
+				raise error
+			_log.debug('Retrying %s %s after %s'%(method, endpoint, error or resp.status_code))
+			metrics.counter('http_retries', endpoint).inc()
+			self._wait(attempt)
+			attempt += 1
+
+	def get(self, url, **kwargs):
+		return self.request('GET', url, idempotent = True, **kwargs)
+
+	def post(self, url, **kwargs):
+		return self.request('POST', url, **kwargs)
+
+	def close(self):
+		with self._lock:
+			sessions, self._sessions = self._sessions, dict()
+		for session in sessions.values():
+			session.close()
+
+def unsent(error):
+	'''
+		True when a request failed before it was sent, a connect timeout is a ConnectionError too
+	'''
+	return isinstance(error, requests.ConnectTimeout) or (isinstance(error, requests.ConnectionError) and _refused(error))
+
+def retryable(error):
+	'''
+		True when a failed call that is not idempotent is safe to send again,
+		it was never sent, or the server refused it with a 5xx.
+		Any other error may come after the server acted on the call
+	'''
+	if isinstance(error, requests.HTTPError):
+		return error.response is not None and error.response.status_code in RETRY_STATUS
+	return unsent(error)
+
+def _refused(error):
+	'''
+		True when the connection could not be established at all
+	'''
+	reason = error.args[0] if error.args else None
+	return isinstance(getattr(reason, 'reason', reason), NewConnectionError)
@@ -1,4 +1,6 @@
 from threading import Thread
+from http import HTTPStatus
+import asyncio
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from collections import defaultdict, namedtuple
 import json
@@ -10,18 +12,20 @@ from .config import config
 _log = getLogger('util.http')
 
 
+def _encode(resp):
+	if isinstance(resp, dict):
+		resp = json.dumps(resp)
+	if not isinstance(resp, bytes):
+		resp = resp.encode()
+	return resp
+
 class Request(BaseHTTPRequestHandler):
 	def __init__(self, *args, **kwargs):
 		self._routes = defaultdict(dict)
 		super().__init__(*args, **kwargs)
 
 	def _write_resp(self, resp):
-		if isinstance(resp, dict):
-			resp = json.dumps(resp)
-		if not isinstance(resp, bytes):
-			resp = resp.encode()
-		
-		self.wfile.write(resp)
+		self.wfile.write(_encode(resp))
 
 	def _load_req(self):
 		length = int(self.headers.get('Content-Length', 0))
@@ -75,6 +79,45 @@ class Routes(Thread):
 	def join(self, *args):
 		self._server.shutdown()
 		return super().join(*args)
+
+	def serve(self):
+		'''
+			Serves the routes from the running asyncio loop instead of the server thread.
+			Returns the asyncio server, handlers run on the loop and must not block
+		'''
+		return asyncio.start_server(self._serve_conn, self._host or None, self._port)
+
+	async def _serve_conn(self, reader, writer):
+		try:
+			method, path, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+			headers = dict()
+			while True:
+				line = await reader.readline()
+				if line in (b'\r\n', b'\n', b''):
+					break
+				name, _, value = line.decode('latin-1').partition(':')
+				headers[name.strip().lower()] = value.strip()
+			length = int(headers.get('content-length', 0))
+			data = json.loads((await reader.readexactly(length)).decode()) if length else None
+			extra = ['Access-Control-Allow-Origin: *']
+			if method == 'OPTIONS':
+				code, resp = 200, None
+				extra += ['Access-Control-Allow-Methods: PATCH, PUT, OPTIONS', 'Access-Control-Allow-Headers: Content-Type']
+			else:
+				try:
+					code, resp = self.handle(method, path, data)
+				except ValueError:
+					code, resp = 404, None
+			head = ['HTTP/1.0 %s %s'%(code, HTTPStatus(code).phrase)] + extra + ['', '']
+			writer.write('\r\n'.join(head).encode('latin-1'))
+			if resp:
+				writer.write(_encode(resp))
+			await writer.drain()
+		except Exception as e:
+			_log.error('Failed to serve request')
+			_log.exception(e)
+		finally:
+			writer.close()
 		
 	@staticmethod
 	def build_route_pattern(route):
@@ -0,0 +1,92 @@
+from bisect import bisect_left
+from threading import Lock
+
+'''
+	This module implements low overhead counters and latency histograms.
+	Histograms count observations into a fixed set of buckets,
+	so recording is a bisect and an increment, and percentiles are
+	estimated as the upper bound of the bucket they fall in.
+	Updates are not locked, under contention a rare increment may be lost,
+	which is an acceptable trade for keeping the hot path cheap.
+'''
+
+# Bucket upper bounds in seconds, 1-2-5 steps from 10us to 60s
+BUCKETS = tuple(m * 10 ** e for e in range(-5, 2) for m in (1, 2, 5)) + (60.0,)
+
+def label(*labels):
+	return '/'.join('*' if l is None else str(l) for l in labels)
+
+class Counter:
+	__slots__ = ('value',)
+	def __init__(self):
+		self.value = 0
+
+	def inc(self, count = 1):
+		self.value += count
+
+	@property
+	def snapshot(self):
+		return self.value
+
+class Histogram:
+	__slots__ = ('_bounds', '_counts', 'count', 'sum', 'max')
+	def __init__(self, bounds = BUCKETS):
+		self._bounds = bounds
+		self._counts = [0] * (len(bounds) + 1)	# The last bucket catches everything above the highest bound
+		self.count = 0
+		self.sum = 0.0
+		self.max = 0.0
+
+	def observe(self, value):
+		self._counts[bisect_left(self._bounds, value)] += 1
+		self.count += 1
+		self.sum += value
+		if value > self.max:
+			self.max = value
+
+	def percentile(self, p):
+		if not self.count:
+			return 0.0
+		rank = self.count * p / 100.0
+		seen = 0
+		for x, count in enumerate(self._counts):
+			seen += count
+			if seen >= rank:
+				return self._bounds[x] if x < len(self._bounds) else self.max
+		return self.max
+
+	@property
+	def snapshot(self):
+		return dict(count = self.count,
+					mean = self.sum / self.count if self.count else 0.0,
+					max = self.max,
+					p50 = self.percentile(50),
+					p95 = self.percentile(95),
+					p99 = self.percentile(99))
+
+class Registry:
+	def __init__(self):
+		self._metrics = dict()
+		self._lock = Lock()
+
+	def _get(self, kind, name, labels):
+		key = (name, labels)
+		metric = self._metrics.get(key)
+		if metric is None:
+			with self._lock:
+				metric = self._metrics.setdefault(key, kind())
+		return metric
+
+	def counter(self, name, *labels):
+		return self._get(Counter, name, labels)
+
+	def histogram(self, name, *labels):
+		return self._get(Histogram, name, labels)
+
+	def snapshot(self):
+		snap = dict()
+		for (name, labels), metric in list(self._metrics.items()):
+			snap.setdefault(name, dict())[label(*labels)] = metric.snapshot
+		return snap
+
+metrics = Registry()
@@ -1,15 +1,50 @@
 import zmq
+import zmq.asyncio
 import threading
 import json
 import time
 from collections import defaultdict
 from .log import getLogger
+from .metrics import metrics
+from .schema import Schema, SchemaError
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
 moduleLogger = getLogger(__name__)
 _log = moduleLogger
+
+'''
+	Messages are framed in one of two ways:
+		v1	a single frame, the string "topic json"
+		v2	two frames, the topic, then a two byte header, b'2' and a body codec tag, followed by the body
+	v2 keeps the body apart from the topic, so it is decoded straight from the received frame
+	with copy=False, without splitting and rejoining the message, and topics may contain spaces.
+	The body is json, or msgpack when it is installed and the publisher asks for it.
+	Receivers tell the framings apart by the first frame's more flag, so old v1 publishers keep working.
+'''
+
+_V2 = b'2'
+_CODECS = dict(json = b'j', msgpack = b'm')
+
+def _json_body(event):
+	return json.dumps(event, separators = (',', ':')).encode()
+
+def _msgpack_body(event):
+	return msgpack.packb(event, use_bin_type = True)
+
+_ENCODERS = {b'j': _json_body, b'm': _msgpack_body}
+_DECODERS = {_V2 + b'j': lambda body: json.loads(str(body, 'utf-8'))}	# Keyed on the whole header
+if msgpack:
+	_DECODERS[_V2 + b'm'] = lambda body: msgpack.unpackb(body, raw = False)
+
+# Messages received per pass of the watcher before control commands are checked again
+DRAIN_BATCH = 1000
+
 class HandlerNotFound(Exception):
 	pass
 
-class InvalidArguements(Exception):
+class InvalidArguements(SchemaError):
 	pass
 
 class RPCError(Exception):
@@ -48,6 +83,12 @@ class Event(Message):
 		return self.getOption('event', {})['type']
 
 class Transport(threading.Thread):
+	'''
+		A watched transport runs a poller over its data socket and an inproc control socket.
+		Every wakeup drains up to DRAIN_BATCH waiting messages without blocking,
+		and other threads stop the watcher or change subscriptions through the control socket,
+		as zmq sockets must only be used from the thread that polls them.
+	'''
 	def __init__(self, path):
 		self._log = moduleLogger.getChild('transport %s'%path)
 		self._path = path
@@ -55,6 +96,7 @@ class Transport(threading.Thread):
 		self._watched = False
 		self.__socket_lck = threading.Lock()
 		self._event_id = 0
+		self._control = None
 		super(Transport, self).__init__()
 		self.daemon = True
 
@@ -62,6 +104,7 @@ class Transport(threading.Thread):
 		self._log.debug('opening socket')
 		self._context = zmq.Context()
 		self._socket = self._context.socket(self.type)
+		self._configure(self._socket)
 		if self.type == zmq.PUB:
 			self._log.debug('transport type is publisher, binding to socket')
 			self._socket.bind(self._path)
@@ -69,22 +112,51 @@ class Transport(threading.Thread):
 			self._log.debug('transport type is subscriber, connecting to socket')
 			self._socket.connect(self._path)
 
+	def _configure(self, socket):
+		'''
+			Sets socket options, called before the socket binds or connects
+		'''
+		pass
+
 	def _pack_event(self, topic, event):
 		msg = json.dumps(event)
 		return '%s %s'%(topic, msg)
 
 	def _unpack_event(self, msg):
-		topic = msg.split(' ')[0]
-		event = ' '.join(msg.split(' ')[1:])
+		topic, _, event = msg.partition(' ')
 		return topic, json.loads(event)
 
-	def _recv(self, noError = False,):
+	def _unpack_frames(self, topic, body):
+		'''
+			Decodes a v2 message from its topic and body frames
+		'''
+		buffer = body.buffer
+		decode = _DECODERS.get(bytes(buffer[:2]))
+		if decode is None:
+			raise ValueError('Unknown framing or body codec %s'%bytes(buffer[:2]))
+		return topic.bytes.decode(), decode(buffer[2:])
+
+	def _recv_frames(self, first, recv):
+		'''
+			Decodes a message in either framing from its first frame,
+			`recv` returns the frames that follow it
+		'''
+		if not first.more:
+			return self._unpack_event(first.bytes.decode())
+		body = recv()
+		if body.more:
+			raise ValueError('Unknown message framing')
+		return self._unpack_frames(first, body)
+
+	def _recv(self, noError = False, flags = 0):
 		if self._watched and not noError:
 			raise RPCError('you cannot recieve on a watched connection')
 		try:
 			self._log.debug('waiting for incoming data')
-			data = self._socket.recv_string()
-			topic, msg = self._unpack_event(data)
+			first = self._socket.recv(flags, copy = False)
+			topic, msg = self._recv_frames(first, lambda: self._socket.recv(copy = False))
+		except zmq.Again:
+			raise
 		except zmq.ZMQError:
 			return None
 		except ValueError:
@@ -98,63 +170,215 @@ class Transport(threading.Thread):
 		self._log.debug('sending data %s'%data)
 		self._socket.send_string(data)
 
+	def _command(self, *args):
+		'''
+			Sends a command to the watcher thread
+		'''
+		with self.__socket_lck:
+			self._control.send_string(' '.join(args))
+
 	def _close(self):
 		if self._watched:
 			self._exit.set()
+			self._command('stop')
+			return
 		self._socket.close()
 
 	def _watch(self, handler):
 		self._log.debug('setting up watcher')
 		self._handler = handler
+		endpoint = 'inproc://transport-control-%s'%id(self)
+		self._control_in = self._context.socket(zmq.PAIR)
+		self._control_in.bind(endpoint)
+		self._control = self._context.socket(zmq.PAIR)
+		self._control.connect(endpoint)
 		self._watched = True
 		self.start()
 
+	def _on_command(self, command, arg):
+		if command == 'stop':
+			self._exit.set()
+		elif command == 'subscribe':
+			self._socket.setsockopt_string(zmq.SUBSCRIBE, arg)
+		elif command == 'unsubscribe':
+			self._socket.setsockopt_string(zmq.UNSUBSCRIBE, arg)
+		else:
+			self._log.warning('Unknown control command %s'%command)
+
+	def _drain_control(self):
+		while True:
+			try:
+				command, _, arg = self._control_in.recv_string(zmq.NOBLOCK).partition(' ')
+			except zmq.Again:
+				return
+			self._on_command(command, arg)
+
+	def _filter(self, messages):
+		'''
+			Called with each batch of received messages, returns the messages to handle
+		'''
+		return messages
+
+	def _drain(self):
+		'''
+			Handles a batch of at most DRAIN_BATCH messages waiting on the data socket.
+			Anything left is handled after the watcher has polled again,
+			so control commands are checked between batches
+		'''
+		messages = []
+		while len(messages) < DRAIN_BATCH:
+			try:
+				message = self._recv(noError = True, flags = zmq.NOBLOCK)
+			except zmq.Again:
+				break
+			except RPCError:
+				self._log.warning('Dropping malformed message')
+				continue
+			if message is None:
+				break
+			message._received = time.perf_counter()	# firehose_enqueue includes the wait behind the rest of the batch
+			messages.append(message)
+		count = 0
+		for message in self._filter(messages):
+			try:
+				self._handler(message)
+			except Exception as e:
+				self._log.error('Handler for topic %s threw an exception'%message.topic)
+				self._log.exception(e)
+			metrics.histogram('firehose_enqueue', message.topic).observe(time.perf_counter() - message._received)
+			count += 1
+		return count
+
 	def run(self):
 		self._log.debug('Watching for data...')
-		while not self._exit.isSet():
-			message = self._recv(noError = True)
-			if message:
-				self._handler(message)
-			else:
-				message = None
-				time.sleep(1)
+		poller = zmq.Poller()
+		poller.register(self._socket, zmq.POLLIN)
+		poller.register(self._control_in, zmq.POLLIN)
+		while not self._exit.is_set():
+			try:
+				ready = dict(poller.poll())
+			except zmq.ZMQError as e:
+				if e.errno == zmq.ETERM:
+					break
+				self._log.error('Polling failed')
+				self._log.exception(e)
+				continue
+			if self._control_in in ready:
+				self._drain_control()
+			if self._socket in ready:
+				self._drain()
+		self._socket.close(linger = 0)
+		self._control_in.close(linger = 0)
+		with self.__socket_lck:
+			self._control.close(linger = 0)
+		self._log.debug('Exiting.')
 
 class Subscriber(Transport):
-	def __init__(self, path):
+	'''
+		zmq drops messages silently once `hwm` messages are queued on the socket,
+		0 queues without limit and None keeps zmq's default of 1000.
+		`rcvbuf` sets the kernel receive buffer in bytes.
+		Only the latest message received in a batch is handled for `conflate` topics,
+		the ones before it are dropped and counted in firehose_conflated.
+		When publishers number each topic's messages under the `sequence` payload key,
+		gaps in the numbering are counted in firehose_lost, making slow consumer loss visible.
+	'''
+	def __init__(self, path, hwm = None, rcvbuf = None, conflate = (), sequence = None):
 		super().__init__(path)
 		self._log = moduleLogger.getChild('publisher: %s'%path)
 		self._handlers = defaultdict(list)
+		self._rejects = dict()
+		self._hwm = hwm
+		self._rcvbuf = rcvbuf
+		self._conflate = frozenset(conflate or ())
+		self._sequence = sequence
+		self._last_seq = dict()
 		self.type = zmq.SUB
 
+	@classmethod
+	def from_config(cls, conf):
+		'''
+			Builds a subscriber from the api.firehose config section, or a bare uri
+		'''
+		if isinstance(conf, str):
+			return cls(conf)
+		rcvbuf = int(conf.rcvbuf)
+		return cls(conf.uri,
+					hwm = int(conf.hwm),
+					rcvbuf = rcvbuf if rcvbuf > 0 else None,
+					conflate = conf.conflate,
+					sequence = conf.sequence)
+
+	def _configure(self, socket):
+		if self._hwm is not None:
+			socket.setsockopt(zmq.RCVHWM, self._hwm)
+		if self._rcvbuf is not None:
+			socket.setsockopt(zmq.RCVBUF, self._rcvbuf)
+
+	def _check_sequence(self, message):
+		event = message.event
+		seq = event.get(self._sequence) if isinstance(event, dict) else None
+		if not isinstance(seq, int):
+			return
+		topic = message.topic
+		last = self._last_seq.get(topic)
+		self._last_seq[topic] = seq
+		if last is None:
+			return
+		if seq > last + 1:
+			metrics.counter('firehose_lost', topic).inc(seq - last - 1)
+		elif seq <= last:	# The publisher restarted and numbers from the beginning again
+			metrics.counter('firehose_seq_resets', topic).inc()
+
+	def _filter(self, messages):
+		if self._sequence:
+			for message in messages:
+				self._check_sequence(message)
+		if not self._conflate:
+			return messages
+		latest = dict()
+		for x, message in enumerate(messages):
+			if message.topic in self._conflate:
+				if message.topic in latest:
+					metrics.counter('firehose_conflated', message.topic).inc()
+				latest[message.topic] = x
+		if not latest:
+			return messages
+		keep = set(latest.values())
+		return [m for x, m in enumerate(messages) if x in keep or not m.topic in self._conflate]
+
 	def open(self):
 		super().open()
 		self._watch(self._process)
 
-	def addHandler(self, topic, func, mapping = {}, strict = True): #mapping defines optional a required arguements eg {'foo': True, 'bar': False}
-		self._handlers[topic].append(dict(func = func, args = mapping, strict = strict))
+	def addHandler(self, topic, func, mapping = {}, strict = True, schema = None):
+		'''
+			Messages on `topic` are checked against `schema`, a util.schema.Schema, before `func` is called.
+			Without one, strict handlers check the legacy `mapping` of arguement names
+			to whether they are required, eg {'foo': True, 'bar': False}
+		'''
+		if schema is None and strict:
+			schema = Schema.from_mapping(mapping)
+		validate = schema.compile() if schema is not None else None
+		self._handlers[topic].append((func, validate))
+		self._rejects[topic] = metrics.counter('firehose_rejects', topic)
 		self._subscribe(topic)
 		self._log.debug('Registering handler for %s'%topic)
-	
+
 	def _subscribe(self, topic):
-		self._socket.setsockopt_string(zmq.SUBSCRIBE, topic)
+		if self._watched:
+			self._command('subscribe', topic)
+		else:
+			self._socket.setsockopt_string(zmq.SUBSCRIBE, topic)
 
 	def _handle(self, topic, message):
 		handlers = self._handlers.get(topic, None)
 		if not handlers:
 			raise HandlerNotFound('No handler found for %s'%topic)
-		else:
-			for handler in handlers:
-				if handler['strict']:
-					required = [x for x, y in handler['args'].iteritems() if y] # These args are required
-					optional = [x for x, y in handler['args'].iteritems() if not y] # and these are optional
-					for arg in message.keys():
-						if arg in required:
-							required.remove(arg)
-						elif not arg in optional:
-							raise InvalidArguements('extra arguement %s provided'%arg)
-					if required:
-						raise InvalidArguements('Not all required arguements provided %s'%required)
-				handler['func'](message)
+		for func, validate in handlers:
+			if validate is not None:
+				validate(message)
+			func(message)
 
 	def _process(self, message):
 		try:
@@ -162,7 +386,9 @@ class Subscriber(Transport):
 		except HandlerNotFound as e:
 			return dict(success = False, error = 'HandlerNotFound')
 
-		except InvalidArguements as e:
+		except SchemaError as e:
+			self._rejects[message.topic].inc()
+			self._log.debug('Rejected message on %s: %s'%(message.topic, e))
 			return dict(success = False, error = str(e))
 
 		return dict(success = True, results = result)
@@ -171,12 +397,81 @@ class Subscriber(Transport):
 		response = Response(**self._call(message))
 		self._send(response)
 
+class AsyncSubscriber(Subscriber):
+	'''
+		A Subscriber for an asyncio event loop.
+		Messages are received by watch(), a coroutine run as a task on the loop,
+		instead of a watcher thread, and handlers are called on the loop.
+	'''
+	def open(self):
+		self._log.debug('opening asyncio socket')
+		self._context = zmq.asyncio.Context()
+		self._socket = self._context.socket(zmq.SUB)
+		self._configure(self._socket)
+		self._socket.connect(self._path)
+		for topic in self._handlers:
+			self._subscribe(topic)
+
+	def _subscribe(self, topic):
+		if getattr(self, '_socket', None):	# Handlers added before open() are subscribed when it connects
+			super()._subscribe(topic)
+
+	def _recv_async(self, frames):
+		if len(frames) > 2:
+			raise ValueError('Unknown message framing')
+		return Event(*self._recv_frames(frames[0], lambda: frames[1]))
+
+	async def watch(self):
+		self._log.debug('Watching for data...')
+		while True:
+			try:
+				frames = await self._socket.recv_multipart(copy = False)
+			except zmq.ZMQError:
+				break
+			messages = []
+			while True:	# Drain what else is waiting, as the threaded watcher does
+				try:
+					messages.append(self._recv_async(frames))
+				except ValueError:
+					self._log.warning('Dropping malformed message')
+				if len(messages) >= DRAIN_BATCH:
+					break
+				try:
+					frames = await self._socket.recv_multipart(zmq.NOBLOCK, copy = False)
+				except zmq.ZMQError:	# zmq.Again once the socket is empty
+					break
+			for message in self._filter(messages):
+				self._event_id += 1
+				try:
+					self._process(message)
+				except Exception as e:	# A failing handler must not end the watch
+					self._log.error('Handler for topic %s threw an exception'%message.topic)
+					self._log.exception(e)
+
+	def _close(self):
+		self._socket.close()
+
 class Publisher(Transport):
-	def __init__(self, path):
+	'''
+		Publishes with v1 framing by default, which every subscriber understands.
+		v2 pays for its extra frame with small json bodies,
+		use `framing = 2` with `codec = 'msgpack'` for throughput, or for topics containing spaces
+	'''
+	def __init__(self, path, framing = 1, codec = 'json'):
 		self._log = moduleLogger.getChild('publisher: %s'%path)
 		self.type = zmq.PUB
+		if codec == 'msgpack' and msgpack is None:
+			raise ValueError('msgpack is not installed')
+		self._framing = int(framing)
+		self._header = _V2 + _CODECS[codec]
+		self._encode = _ENCODERS[_CODECS[codec]]
 		super(Publisher, self).__init__(path)
 	
+	def _send(self, msg):
+		if self._framing == 1:
+			return super()._send(msg)
+		self._socket.send_multipart([msg.topic.encode(), self._header + self._encode(msg.event)])
+
 	def _publish(self, msg):
 		self._send(msg)
 
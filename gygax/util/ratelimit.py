@@ -0,0 +1,60 @@
+from threading import Lock
+from time import monotonic
+
+'''
+	This module implements token buckets for client side rate limiting.
+	A bucket holds up to `burst` tokens and gains `rate` tokens a second.
+	reserve() always takes a token, running the bucket into debt when it is empty,
+	and returns how long the caller has to wait before using it,
+	so callers are served in the order they reserved and never need to retry.
+'''
+
+class RateLimited(Exception):
+	'''
+		Raised when a server refuses a call for being over its rate limit,
+		`retry_after` is the number of seconds it asked us to wait
+	'''
+	def __init__(self, retry_after, method = None):
+		super().__init__('%s rate limited, retry after %ss'%(method or 'call', retry_after))
+		self.retry_after = retry_after
+		self.method = method
+
+class TokenBucket:
+	__slots__ = ('rate', 'burst', '_tokens', '_stamp', '_lock')
+	def __init__(self, rate, burst = 1):
+		self.rate = float(rate)
+		self.burst = float(burst)
+		self._tokens = self.burst
+		self._stamp = monotonic()
+		self._lock = Lock()
+
+	def _refill(self, now):
+		self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+		self._stamp = now
+
+	def reserve(self):
+		'''
+			Takes a token, returns the seconds to wait before it may be used
+		'''
+		with self._lock:
+			self._refill(monotonic())
+			self._tokens -= 1
+			return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+	def pause(self, seconds):
+		'''
+			Holds back every token for at least `seconds`, as after a server's Retry-After.
+			Pauses overlap rather than add up, as several calls in flight are refused together
+		'''
+		with self._lock:
+			self._refill(monotonic())
+			self._tokens = min(self._tokens, -seconds * self.rate)
+
+	@property
+	def idle(self):
+		'''
+			True when the bucket is full again
+		'''
+		with self._lock:
+			self._refill(monotonic())
+			return self._tokens >= self.burst
@@ -0,0 +1,210 @@
+from threading import Thread, Condition, Event, Lock
+from time import monotonic
+import heapq
+import asyncio
+import itertools
+from .log import getLogger
+
+_log = getLogger('util.scheduler')
+
+'''
+	This module implements a binary heap based replacement for threading.Timer.
+	All pending callbacks are kept in a single heap ordered by due time
+	and are fired from one thread, so the cost of a pending timer is one
+	small list instead of a sleeping OS thread.
+
+	Cancelled entries are only marked as dead and are dropped when they
+	reach the top of the heap, or when more than half of the heap is dead.
+
+	LoopScheduler offers the same interface on top of an asyncio event loop,
+	for the asyncio agent, where timers cost nothing until they fire.
+'''
+
+_WHEN, _SEQ, _KEY, _CALLBACK, _ARGS = range(5)
+
+class Scheduler(Thread):
+	def __init__(self, name = 'scheduler'):
+		self._heap = []
+		self._entries = dict()
+		self._dead = 0
+		self._seq = itertools.count()
+		self._cond = Condition()
+		self._running = Event()
+		super().__init__(name = name)
+		self.daemon = True
+
+	def __len__(self):
+		return len(self._entries)
+
+	def __contains__(self, key):
+		return key in self._entries
+
+	def schedule(self, key, secs, callback, *args):
+		'''
+			Run `callback(*args)` in `secs` seconds.
+			Scheduling an existing key replaces the pending entry.
+		'''
+		entry = [monotonic() + max(secs, 0), next(self._seq), key, callback, args]
+		with self._cond:
+			self._discard(key)
+			self._entries[key] = entry
+			heapq.heappush(self._heap, entry)
+			if self._heap[0] is entry:
+				self._cond.notify()
+		return key
+
+	def cancel(self, key):
+		with self._cond:
+			return self._discard(key)
+
+	def _discard(self, key):
+		entry = self._entries.pop(key, None)
+		if entry is None:
+			return False
+		entry[_CALLBACK] = None
+		self._dead += 1
+		if self._dead > len(self._heap) // 2:
+			self._compact()
+		return True
+
+	def _compact(self):
+		self._heap = [e for e in self._heap if e[_CALLBACK] is not None]
+		heapq.heapify(self._heap)
+		self._dead = 0
+
+	def _next(self):
+		'''
+			Blocks until an entry is due, returns None when stopped
+		'''
+		with self._cond:
+			while self._running.is_set():
+				if not self._heap:
+					self._cond.wait()
+					continue
+				entry = self._heap[0]
+				if entry[_CALLBACK] is None:
+					heapq.heappop(self._heap)
+					self._dead -= 1
+					continue
+				delay = entry[_WHEN] - monotonic()
+				if delay > 0:
+					self._cond.wait(delay)
+					continue
+				heapq.heappop(self._heap)
+				del self._entries[entry[_KEY]]
+				return entry
+		return None
+
+	def start(self):
+		self._running.set()
+		super().start()
+
+	def run(self):
+		_log.debug('Scheduler started with %s pending entries'%len(self._entries))
+		while True:
+			entry = self._next()
+			if entry is None:
+				break
+			try:
+				entry[_CALLBACK](*entry[_ARGS])
+			except Exception as e:
+				_log.error('Scheduled callback for key %s threw an exception'%entry[_KEY])
+				_log.exception(e)
+		_log.debug('Exiting.')
+
+	def stop(self):
+		with self._cond:
+			self._running.clear()
+			self._cond.notify_all()
+
+	def join(self, timeout = None):
+		self.stop()
+		if self.is_alive():
+			return super().join(timeout)
+
+def on_loop(loop):
+	'''
+		True when called from a coroutine or callback running on `loop`
+	'''
+	try:
+		return asyncio.get_running_loop() is loop
+	except RuntimeError:
+		return False
+
+class LoopScheduler:
+	'''
+		Scheduler for an asyncio loop, timers are armed with loop.call_at.
+		It may be used from any thread, calls from outside a running loop
+		are passed to it with call_soon_threadsafe.
+		Due times are fixed when schedule() is called, not when the timer is armed.
+	'''
+	def __init__(self, loop):
+		self._loop = loop
+		self._entries = dict()	# key -> token until the timer is armed, then its TimerHandle
+		self._lock = Lock()
+
+	def __len__(self):
+		return len(self._entries)
+
+	def __contains__(self, key):
+		return key in self._entries
+
+	def _on_loop(self, fn, *args):
+		if on_loop(self._loop) or not self._loop.is_running():
+			fn(*args)
+		else:
+			self._loop.call_soon_threadsafe(fn, *args)
+
+	def schedule(self, key, secs, callback, *args):
+		'''
+			Run `callback(*args)` in `secs` seconds.
+			Scheduling an existing key replaces the pending entry.
+		'''
+		when = self._loop.time() + max(secs, 0)
+		token = object()
+		with self._lock:
+			old = self._entries.get(key)
+			self._entries[key] = token
+		if isinstance(old, asyncio.TimerHandle):
+			self._on_loop(old.cancel)
+		self._on_loop(self._arm, key, token, when, callback, args)
+		return key
+
+	def _arm(self, key, token, when, callback, args):
+		handle = self._loop.call_at(when, self._fire, key, callback, args)
+		with self._lock:
+			if self._entries.get(key) is token:
+				self._entries[key] = handle
+				return
+		handle.cancel()	# Cancelled or replaced before it was armed
+
+	def _fire(self, key, callback, args):
+		with self._lock:
+			self._entries.pop(key, None)
+		try:
+			callback(*args)
+		except Exception as e:
+			_log.error('Scheduled callback for key %s threw an exception'%key)
+			_log.exception(e)
+
+	def cancel(self, key):
+		with self._lock:
+			entry = self._entries.pop(key, None)
+		if entry is None:
+			return False
+		if isinstance(entry, asyncio.TimerHandle):
+			self._on_loop(entry.cancel)
+		return True
+
+	def start(self):
+		_log.debug('Loop scheduler started with %s pending entries'%len(self._entries))
+
+	def stop(self):
+		with self._lock:
+			entries, self._entries = self._entries, dict()
+		for entry in entries.values():
+			if isinstance(entry, asyncio.TimerHandle):
+				self._on_loop(entry.cancel)
+
+	def join(self, timeout = None):
+		self.stop()
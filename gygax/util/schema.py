@@ -0,0 +1,61 @@
+'''
+	This module implements declarative payload schemas for pub/sub handlers.
+	A Schema is compiled once, when its handler is registered, into a validator closure
+	holding the fields as a tuple and the allowed keys as a frozenset,
+	so checking a message is a few dict lookups, isinstance and len calls.
+	Validators raise SchemaError on the first problem they find.
+'''
+
+_MISSING = object()
+
+class SchemaError(ValueError):
+	pass
+
+class Field:
+	'''
+		`types` is a type or tuple of types the value must be an instance of, None accepts anything.
+		`max_len` caps the length of str, list and dict values
+	'''
+	__slots__ = ('types', 'required', 'max_len')
+	def __init__(self, types = None, required = True, max_len = None):
+		self.types = types
+		self.required = required
+		self.max_len = max_len
+
+class Schema:
+	'''
+		Describes a dict payload as keyword arguments name = Field(...).
+		Keys not described are rejected unless `extra` is True
+	'''
+	def __init__(self, extra = False, **fields):
+		self.fields = fields
+		self.extra = extra
+
+	@classmethod
+	def from_mapping(cls, mapping):
+		'''
+			Builds a schema from Subscriber's legacy {'name': required} mapping
+		'''
+		return cls(**{name: Field(required = bool(required)) for name, required in mapping.items()})
+
+	def compile(self):
+		checks = tuple((name, f.types, f.required, f.max_len) for name, f in self.fields.items())
+		allowed = frozenset(self.fields)
+		extra = self.extra
+		def validate(message):
+			if not isinstance(message, dict):
+				raise SchemaError('payload is not an object')
+			if not extra and not allowed.issuperset(message):
+				raise SchemaError('extra arguement %s provided'%', '.join(sorted(set(message) - allowed)))
+			for name, types, required, max_len in checks:
+				value = message.get(name, _MISSING)
+				if value is _MISSING:
+					if required:
+						raise SchemaError('required arguement %s not provided'%name)
+					continue
+				if types is not None and not isinstance(value, types):
+					raise SchemaError('arguement %s has type %s'%(name, type(value).__name__))
+				if max_len is not None and len(value) > max_len:
+					raise SchemaError('arguement %s is longer than %s'%(name, max_len))
+			return message
+		return validate
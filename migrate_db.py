@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+import sys
+from sqlalchemy import inspect
+from gygax.util.log import getLogger
+from gygax.app import db, Base
+from gygax.models import Schedule, Slack, DirectoryEntry
+from gygax.api.storage import session_scope
+from gygax.bot import codec
+
+'''
+	Brings an existing database up to date with the current models.
+	Missing tables are created, columns added to existing tables are added with ALTER TABLE,
+	and scheduled events stored with pickle are rewritten using gygax.bot.codec.
+	Every step checks what is already there, so it runs on each container start.
+'''
+
+_log = getLogger(__name__)
+
+# Columns added to tables that existed before them, create_all() only creates missing tables
+ADDED_COLUMNS = [
+	Slack.__table__.c.real_name,
+	Slack.__table__.c.tz,
+	DirectoryEntry.__table__.c.tz,
+]
+
+def create_tables():
+	_log.info('Creating missing tables')
+	Base.metadata.create_all(db, checkfirst = True)
+
+def add_columns():
+	inspector = inspect(db)
+	for column in ADDED_COLUMNS:
+		table = column.table.name
+		if column.name in [c['name'] for c in inspector.get_columns(table)]:
+			continue
+		_log.info('Adding column %s.%s'%(table, column.name))
+		db.execute('ALTER TABLE %s ADD COLUMN %s %s'%(table, column.name, column.type.compile(dialect = db.dialect)))
+
+def migrate_schedule(chunk = 1000):
+	converted = 0
+	failed = 0
+	last = 0
+	while True:
+		with session_scope() as session:
+			rows = session.query(Schedule).filter(Schedule.id > last).order_by(Schedule.id).limit(chunk).all()
+			if not rows:
+				break
+			for row in rows:
+				last = row.id
+				if not row.data or not codec.is_legacy(row.data):
+					continue
+				try:
+					row.event = codec.decode(row.data)
+					converted += 1
+				except Exception as e:
+					_log.error('Unable to convert scheduled event %s'%row.uuid)
+					_log.exception(e)
+					failed += 1
+	_log.info('Converted %s scheduled events, %s failed'%(converted, failed))
+	return failed
+
+if __name__ == '__main__':
+	create_tables()
+	add_columns()
+	sys.exit(1 if migrate_schedule() else 0)
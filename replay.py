@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+import sys
+import time
+from collections import deque
+from gygax.util.log import getLogger
+from gygax.bot.dispatch import Dispatcher, Proxy
+from gygax.bot.journal import replay
+from gygax.bot.action import all_actions
+from gygax.bot.action.message import outbound
+from gygax.app import slack
+from gygax.api.enricher import enricher
+
+'''
+	Re-runs a recorded agent journal through a fresh Dispatcher at full speed,
+	to reproduce incidents or measure handler throughput against real traffic.
+	Events pushed by handlers are dispatched in turn, scheduling is logged and skipped.
+
+	WARNING: the handlers are the real ones. Without --dry-run a production journal
+	sends real slack messages and writes to the game database.
+	--dry-run logs slack posts and dm lookups instead of making them and skips profile lookups,
+	database writes and calls to the auth server still happen, replay against a copy of the database.
+
+	usage: python3 replay.py <journal directory> [--unfinished] [--dry-run]
+'''
+
+_log = getLogger('replay')
+
+def _schedule(event, time, key = None, repeat = False, **kwargs):
+	_log.debug('Not scheduling %s at %s, key: %s'%(event.topic, time, key))
+	return key
+
+def _cancel(key):
+	_log.debug('Not cancelling %s'%key)
+	return False
+
+def _post(recipient, text, attachments):
+	_log.info('Not posting to %s: %s'%(recipient, text or attachments))
+	return True
+
+def dry_run():
+	'''
+		Stubs out slack posting, dm channel and profile lookups
+	'''
+	outbound._post = _post
+	slack.msg = lambda channel, message = None, attach = []: _post(('channel', channel), message, attach)
+	slack.dm = lambda user, message = None, cached = True, attach = []: _post(('user', user), message, attach)
+	slack.resolve_dms = lambda users: None
+	enricher.request = lambda slack_id: _log.debug('Not looking up the slack profile of %s'%slack_id)
+
+if __name__ == '__main__':
+	if len(sys.argv) < 2:
+		print('usage: %s <journal directory> [--unfinished] [--dry-run]'%sys.argv[0])
+		print('WARNING: without --dry-run the replayed events send real slack messages')
+		sys.exit(1)
+	if '--dry-run' in sys.argv:
+		dry_run()
+	else:
+		_log.warning('Replaying without --dry-run, real slack messages will be sent')
+	pending = deque()
+	dispatch = Dispatcher()
+	proxy = Proxy(dispatch, pending.append, _schedule, _cancel)
+	actions = [action(proxy) for action in all_actions]
+	count, elapsed = replay(sys.argv[1], dispatch, pending, unfinished = '--unfinished' in sys.argv)
+	start = time.perf_counter()
+	outbound.join()	# Sends the posts still buffered or queued, they are part of the replay
+	elapsed += time.perf_counter() - start
+	_log.info('Replayed %s events in %.2fs, %.0f events/s'%(count, elapsed, count / elapsed if elapsed else 0))
+	enricher.join()
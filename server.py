@@ -2,15 +2,24 @@ import signal
 import sys
 from gygax.app import agent, db, slack
 from gygax.util.http import http
+from gygax.util.config import config
+from gygax.bot.action.message import outbound
+from gygax.api.enricher import enricher
+from gygax.api.storage import load_outbound
 import time
 
 def start_agent():
+	slack.warm()
+	outbound.restore(load_outbound())
 	agent.start()
-	slack.start()
-	http.start()
+	if config.agent.mode != 'asyncio':	# The asyncio agent serves the firehose and http routes on its loop
+		slack.start()
+		http.start()
 
 def sig_handler(sig, frame):
 	agent.join(10)
+	outbound.join(5)
+	enricher.join(5)
 	sys.exit(0)
 
 if __name__ == '__main__':